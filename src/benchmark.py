@@ -0,0 +1,305 @@
+"""Micro-benchmarks for the simulation hot paths.
+
+Run from the repository root:
+
+    python src/benchmark.py                      # run and compare against results/benchmarks/baseline.json
+    python src/benchmark.py --save-baseline      # run and make the results the new baseline
+
+Every benchmark runs at a realistic size (one state sweep of one experiment) and at 100x that size. Results are
+written as JSON to results/benchmarks/; the exit code is 1 if any benchmark regressed against the baseline.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+from dataclasses import replace
+from datetime import datetime
+from types import SimpleNamespace
+from typing import *
+
+import numpy as np
+
+import config
+import seeding
+from environment.action_spaces import HOActionSpaceC
+from environment.state_spaces import HOStateB, HOStateC
+from experiments.mdhyp import MonotonicUncalibrated, UniformDistributionUncalibrated
+from learner.geometry_proficiency import (
+    proficiency_measure_monotonic,
+    proficiency_measure_uniform,
+)
+from learner.learners import Learner
+from learner.persistence import persist_abandon_time
+
+BENCHMARK_DIR = "results/benchmarks"
+SIZES = {"realistic": 1, "100x": 100}
+
+BENCHMARKS = {}
+
+
+def benchmark(name: Text):
+    """Register `setup(scale) -> Callable[[], Any]` as a benchmark; only the returned callable is timed."""
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def _action_space():
+    return HOActionSpaceC()
+
+
+def _responses(action_space, num_responses: int, rng: random.Random) -> List[Text]:
+    labels = list(action_space.actions.keys())
+    filler = "the learner considers which distance to measure next given the orbit".split()
+    return [
+        " ".join(rng.choice(filler) for _ in range(250))
+        + f" I could {rng.choice(labels)}, but the next action is {rng.choice(labels)}"
+        for _ in range(num_responses)
+    ]
+
+
+@benchmark("HOStateB.generate_states")
+def _(scale):
+    return lambda: [HOStateB.generate_states() for _ in range(scale)]
+
+
+@benchmark("HOStateC.generate_states")
+def _(scale):
+    return lambda: [HOStateC.generate_states() for _ in range(scale)]
+
+
+@benchmark("HOStateB.generate_thorough_state_space")
+def _(scale):
+    return lambda: [HOStateB.generate_thorough_state_space(ks=[3]) for _ in range(scale)]
+
+
+@benchmark("Vignette.as_langsmith_sample")
+def _(scale):
+    from experiments.experiment import Vignette
+
+    action_space = _action_space()
+    learner = (
+        Learner(action_space)
+        .add_hypothesis(
+            proficiency_measure_monotonic(MonotonicUncalibrated, action_space)[0]
+        )
+        .add_hypothesis(persist_abandon_time(MonotonicUncalibrated, action_space)[0])
+    )
+    learner = replace(learner, persistence_level=5, geometry_proficiency_level=5)
+    states = list(config.STATE_SWEEP_MED.states) * scale
+    vignettes = [
+        Vignette(
+            experiment_id="benchmark",
+            learner=learner,
+            state=state,
+            state_sweep_name="benchmark",
+        )
+        for state in states
+    ]
+    return lambda: [vignette.as_langsmith_sample for vignette in vignettes]
+
+
+def _extract_last_label(text: Text, labels: Iterable[Text]) -> Optional[Text]:
+    """The label parser `ActionLabelMatcher` replaced: one `rfind` per label. Kept as the baseline."""
+    last_position = -1
+    last_label = None
+    for label in labels:
+        position = text.rfind(label)
+        if position > last_position:
+            last_position = position
+            last_label = label
+    return last_label
+
+
+@benchmark("extract_last_label")
+def _(scale):
+    action_space = _action_space()
+    responses = _responses(
+        action_space, 210 * scale, seeding.py_random("benchmark", "action_labels")
+    )
+    labels = action_space.actions.keys()
+    return lambda: [
+        _extract_last_label(response, labels) or "UNPREDICTED" for response in responses
+    ]
+
+
+@benchmark("ActionLabelMatcher.last_labels")
+def _(scale):
+    action_space = _action_space()
+    responses = _responses(
+        action_space, 210 * scale, seeding.py_random("benchmark", "action_labels")
+    )
+    return lambda: action_space.matcher.last_labels(responses, default="UNPREDICTED")
+
+
+@benchmark("HOActionSpace.productive_measurement_percentage")
+def _(scale):
+    action_space = _action_space()
+    rng = seeding.py_random(
+        "benchmark", "HOActionSpace.productive_measurement_percentage"
+    )
+    labels = list(action_space.actions.keys())
+    runs = [
+        SimpleNamespace(
+            outputs={"output": rng.choice(labels)},
+            metadata=config.STATE_SWEEP_MED.states[i % 21].state_variables,
+        )
+        for i in range(210 * scale)
+    ]
+    return lambda: action_space.productive_measurement_percentage(runs, [])
+
+
+@benchmark("MonotonicUncalibrated.statistical_test")
+def _(scale):
+    action_space = _action_space()
+    hypothesis = proficiency_measure_monotonic(MonotonicUncalibrated, action_space)[
+        0
+    ].hypothesis
+    rng = seeding.py_random("benchmark", "MonotonicUncalibrated.statistical_test")
+    experiment_set_results = {
+        f"experiment-{i}": {
+            "geometry_proficiency_levels": [i % 10 + 1],
+            "productive_actions_ratio": rng.random(),
+        }
+        for i in range(10 * scale)
+    }
+    return lambda: hypothesis.statistical_test(experiment_set_results)
+
+
+@benchmark("UniformDistributionUncalibrated.statistical_test")
+def _(scale):
+    action_space = _action_space()
+    hypothesis = proficiency_measure_uniform(
+        UniformDistributionUncalibrated, action_space
+    )[0].hypothesis
+    rng = seeding.py_random(
+        "benchmark", "UniformDistributionUncalibrated.statistical_test"
+    )
+    labels = list(action_space.actions.keys())
+    experiment_set_results = {
+        "experiment": {"next_actions": [rng.choice(labels) for _ in range(210 * scale)]}
+    }
+    return lambda: hypothesis.statistical_test(experiment_set_results)
+
+
+def run_benchmarks(names: Iterable[Text], repeats: int) -> dict:
+    results = {}
+    for name in names:
+        results[name] = {}
+        for size, scale in SIZES.items():
+            # Every size starts the unseeded state generators from the same point of their streams.
+            seeding.reset()
+            fn = BENCHMARKS[name](scale)
+            timings = []
+            for _ in range(repeats):
+                # The statistical tests print their results; keep that out of the benchmark output.
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    fn()
+                    timings.append(time.perf_counter() - start)
+            results[name][size] = {
+                "min_seconds": min(timings),
+                "median_seconds": statistics.median(timings),
+                "repeats": repeats,
+            }
+            print(
+                f"{name:<55} {size:>10} {statistics.median(timings) * 1000:>12.3f} ms"
+            )
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[Text]:
+    """Print the ratio of every benchmark to its baseline and return the names of regressions."""
+    regressions = []
+    print(f"\n{'benchmark':<55} {'size':>10} {'vs. baseline':>14}")
+    for name, sizes in results.items():
+        for size, result in sizes.items():
+            baseline_result = baseline.get(name, {}).get(size)
+            if baseline_result is None:
+                print(f"{name:<55} {size:>10} {'(new)':>14}")
+                continue
+            ratio = result["min_seconds"] / baseline_result["min_seconds"]
+            regressed = ratio > 1 + tolerance
+            print(
+                f"{name:<55} {size:>10} {ratio:>13.2f}x{'  REGRESSION' if regressed else ''}"
+            )
+            if regressed:
+                regressions.append(f"{name} [{size}]")
+    return regressions
+
+
+def _git_commit() -> Optional[Text]:
+    try:
+        return (
+            subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL)
+            .decode()
+            .strip()
+        )
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="*", default=list(BENCHMARKS.keys()))
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--baseline", default=os.path.join(BENCHMARK_DIR, "baseline.json")
+    )
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown against the baseline before a benchmark counts as a regression.",
+    )
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "results": run_benchmarks(args.only, args.repeats),
+    }
+
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    output_path = os.path.join(
+        BENCHMARK_DIR, f"{report['meta']['timestamp'].replace(':', '-')}.json"
+    )
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output_path}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(report["results"], baseline["results"], args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
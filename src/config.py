@@ -1,16 +1,68 @@
-import numpy as np
+import os
 
+import seeding
 from environment.action_spaces import HOActionSpaceB, HOActionSpaceC, HOActionSpaceD
 from environment.state_spaces import HOStateB, HOStateC
+from environment.sweep_registry import StateSweepRegistry
 
 DATASET_NAME = "graph-1c"
 
+COMPLETION_CACHE_PATH = ".cache/completions.sqlite"
+COMPLETION_CACHE_MAX_ENTRIES = 500_000
+# Entries evicted at once when the cache is full, and cache hits whose recency is written back at once
+COMPLETION_CACHE_EVICTION_BATCH = 5_000
+COMPLETION_CACHE_ACCESS_BATCH = 256
+PROMPT_CACHE_DIR = ".cache/prompts"
+CHECKPOINT_PATH = ".cache/checkpoints.sqlite"
+# How long a connection to the checkpoint or completion cache database waits for another process's write
+SQLITE_BUSY_TIMEOUT_SECONDS = 60
+# Levels per fused experiment; each batch is checkpointed as soon as it finishes
+FUSED_LEVELS_PER_BATCH = 4
+
+DATASET_UPLOAD_BATCH_SIZE = 200
+# Rendered batches waiting for upload before rendering pauses
+DATASET_UPLOAD_QUEUE_BATCHES = 4
+
+# Per-stage timing and token spans, exported to TRACE_DIR once per `Learner.test_hypothesis` call.
+INSTRUMENTATION_ENABLED = os.environ.get("HYPMIX_TRACE", "0") == "1"
+TRACE_DIR = "results/traces"
+
+# Concurrent prediction
+PREDICTION_MAX_CONCURRENCY = 16
+COMPLETION_TOKENS_ESTIMATE = 512
+MODEL_RATE_LIMITS = {
+    "gpt-4-turbo": {"requests_per_minute": 500, "tokens_per_minute": 300_000},
+    "gpt-4o": {"requests_per_minute": 500, "tokens_per_minute": 300_000},
+    "gpt-3.5-turbo": {"requests_per_minute": 3_500, "tokens_per_minute": 200_000},
+}
+
 ACTION_SPACE = HOActionSpaceC()
-STATE_SWEEP_TINY = HOStateB.generate_uniform_state_space(size="tiny")
-STATE_SWEEP_SMALL = HOStateB.generate_uniform_state_space(size="small")
-STATE_SWEEP_MED = HOStateB.generate_uniform_state_space(size="medium")
-STATE_SWEEP_UNIFORM_1 = HOStateB.generate_state_space_for_uniform_hyp()
-STATE_SWEEP_THOROUGH_K = HOStateB.generate_thorough_state_space(ks=[3])
+
+# State sweeps are generated on first access (e.g. `config.STATE_SWEEP_MED`) and cached on disk, keyed by
+# generator, parameters and random stream (see `seeding`).
+STATE_SWEEP_CACHE_DIR = ".cache/state_sweeps"
+STATE_SWEEPS = StateSweepRegistry(STATE_SWEEP_CACHE_DIR, root_seed=seeding.ROOT_SEED)
+STATE_SWEEPS.register(
+    "STATE_SWEEP_TINY", HOStateB.generate_uniform_state_space, size="tiny"
+)
+STATE_SWEEPS.register(
+    "STATE_SWEEP_SMALL", HOStateB.generate_uniform_state_space, size="small"
+)
+STATE_SWEEPS.register(
+    "STATE_SWEEP_MED", HOStateB.generate_uniform_state_space, size="medium"
+)
+STATE_SWEEPS.register(
+    "STATE_SWEEP_UNIFORM_1", HOStateB.generate_state_space_for_uniform_hyp
+)
+STATE_SWEEPS.register(
+    "STATE_SWEEP_THOROUGH_K", HOStateB.generate_thorough_state_space, ks=[3]
+)
+STATE_SWEEPS.register(
+    "STATE_SWEEP_WITH_TIME_MED", HOStateC.generate_uniform_state_space, size="medium"
+)
 
 
-STATE_SWEEP_WITH_TIME_MED = HOStateC.generate_uniform_state_space(size="medium")
+def __getattr__(name):
+    if name in STATE_SWEEPS:
+        return STATE_SWEEPS.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
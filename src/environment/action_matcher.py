@@ -0,0 +1,69 @@
+import re
+from functools import lru_cache
+from typing import *
+
+
+def _trie_pattern(labels: Iterable[Text]) -> Text:
+    """Compile labels into a prefix-factored regular expression.
+
+    Shared prefixes are matched once, and at every branch a longer label is tried before a label that is a prefix
+    of it, so a match is always the longest complete label starting at that position."""
+    trie = {}
+    for label in labels:
+        node = trie
+        for char in label:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def to_pattern(node: dict) -> Text:
+        is_terminal = "" in node
+        branches = [
+            re.escape(char) + to_pattern(child)
+            for char, child in sorted(node.items())
+            if char != ""
+        ]
+        if not branches:
+            return ""
+        pattern = (
+            branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        )
+        if is_terminal:
+            pattern = "(?:" + pattern + ")?"
+        return pattern
+
+    return to_pattern(trie)
+
+
+class ActionLabelMatcher:
+    """Finds the last action label mentioned in a model response in a single scan of the text."""
+
+    def __init__(self, labels: Iterable[Text]):
+        self.labels = tuple(labels)
+        self._regex = re.compile(_trie_pattern(self.labels))
+
+    def last_label(self, text: Text) -> Optional[Text]:
+        """The label whose last occurrence starts latest in `text` (the longest one if several start there)."""
+        last_match = None
+        for match in self._regex.finditer(text):
+            last_match = match
+        if last_match is None:
+            return None
+        # Matches don't overlap, so a label that starts inside the last match (e.g. "X-F1" inside "MEASURE-X-F1")
+        # is the only way for a later occurrence to have been skipped.
+        for position in range(last_match.end() - 1, last_match.start(), -1):
+            overlapping_match = self._regex.match(text, position)
+            if overlapping_match is not None:
+                return overlapping_match.group()
+        return last_match.group()
+
+    def last_labels(
+        self, texts: Iterable[Text], default: Optional[Text] = None
+    ) -> List[Optional[Text]]:
+        """Batch version of `last_label`."""
+        return [self.last_label(text) or default for text in texts]
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def for_labels(labels: Tuple[Text, ...]) -> "ActionLabelMatcher":
+        """Shared matcher for a set of labels, compiled on first use."""
+        return ActionLabelMatcher(labels)
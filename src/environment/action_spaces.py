@@ -1,8 +1,18 @@
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import *
 
 from langsmith.schemas import Example, Run
 
+from environment.action_matcher import ActionLabelMatcher
+
+
+@lru_cache(maxsize=None)
+def _describe_actions(actions: Tuple[Tuple[Text, Text], ...]) -> str:
+    return "\n".join(
+        [f"{i+1}. {action}: {desc}" for i, (action, desc) in enumerate(actions)]
+    )
+
 
 @dataclass
 class ActionSpace:
@@ -11,12 +21,20 @@ class ActionSpace:
     actions: Dict[Text, Text]
 
     def describe_action_space(self) -> str:
-        return "\n".join(
-            [
-                f"{i+1}. {action}: {desc}"
-                for i, (action, desc) in enumerate(self.actions.items())
-            ]
-        )
+        return _describe_actions(tuple(self.actions.items()))
+
+    @property
+    def description(self) -> str:
+        """`describe_action_space()`, rendered once per distinct set of actions.
+
+        Keyed by the current actions, like `matcher` is by the current labels, so the prompt and the parser
+        never disagree after `actions` is changed."""
+        return self.describe_action_space()
+
+    @property
+    def matcher(self) -> ActionLabelMatcher:
+        """Matcher for the labels of this action space, compiled once per distinct set of labels."""
+        return ActionLabelMatcher.for_labels(tuple(self.actions.keys()))
 
 
 @dataclass
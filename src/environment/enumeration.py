@@ -0,0 +1,175 @@
+"""Streaming enumeration and stratified sampling of measurement-flag state spaces.
+
+With n measurement flags there are 2^n flag vectors, so exhaustive state spaces are produced in chunks, and
+representative sweeps are drawn per stratum (number of measurements k, number of submission attempts) without
+enumerating the space at all.
+"""
+
+import itertools
+import math
+from typing import *
+
+import numpy as np
+
+from environment.state_spaces import MEASUREMENT_FLAGS, State, StateSweep, as_generator
+
+DEFAULT_CHUNK_SIZE = 65_536
+
+
+def count_flag_combinations(
+    num_flags: int = len(MEASUREMENT_FLAGS), ks: Optional[Iterable[int]] = None
+) -> int:
+    ks = range(num_flags + 1) if ks is None else ks
+    return sum(math.comb(num_flags, k) for k in ks)
+
+
+def iter_flag_combinations(
+    num_flags: int = len(MEASUREMENT_FLAGS),
+    ks: Optional[Iterable[int]] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[np.ndarray]:
+    """All flag vectors with exactly k ones for each k in `ks` (default: every k), as 0/1 matrices of at most
+    `chunk_size` rows. Vectors are ordered by k, then lexicographically by the positions of their ones."""
+    ks = range(num_flags + 1) if ks is None else ks
+    for k in ks:
+        if not (0 <= k <= num_flags):
+            raise ValueError(f"k must be between 0 and {num_flags} (inclusive).")
+        positions = itertools.combinations(range(num_flags), k)
+        remaining = math.comb(num_flags, k)
+        while remaining > 0:
+            num_rows = min(chunk_size, remaining)
+            chunk_positions = np.fromiter(
+                itertools.chain.from_iterable(itertools.islice(positions, num_rows)),
+                dtype=np.int64,
+                count=num_rows * k,
+            ).reshape(num_rows, k)
+            flags = np.zeros((num_rows, num_flags), dtype=np.int64)
+            flags[np.arange(num_rows)[:, np.newaxis], chunk_positions] = 1
+            yield flags
+            remaining -= num_rows
+
+
+def sample_flag_combinations(
+    num_flags: int,
+    k: int,
+    num_samples: int,
+    rng: Optional[Union[int, np.random.Generator]] = None,
+) -> np.ndarray:
+    """`num_samples` distinct flag vectors with exactly k ones, drawn uniformly without replacement.
+
+    Returns every such vector if there are no more than `num_samples` of them."""
+    rng = as_generator(rng, "enumeration.sample_flag_combinations")
+    num_combinations = math.comb(num_flags, k)
+    if num_combinations <= num_samples:
+        return np.vstack(list(iter_flag_combinations(num_flags, [k])))
+    if num_flags > 63:
+        raise ValueError("Sampling supports at most 63 flags.")
+
+    bit_values = np.left_shift(1, np.arange(num_flags, dtype=np.int64))
+    codes = np.empty(0, dtype=np.int64)
+    while len(codes) < num_samples:
+        num_draws = 2 * (num_samples - len(codes))
+        # The first k columns of a random permutation of the flag indices are a uniform k-subset.
+        positions = np.argsort(rng.random((num_draws, num_flags)), axis=1)[:, :k]
+        new_codes = bit_values[positions].sum(axis=1)
+        # Deduplicate while keeping the draw order, so that the result stays uniform.
+        codes = np.concatenate((codes, new_codes))
+        _, first = np.unique(codes, return_index=True)
+        codes = codes[np.sort(first)]
+    codes = codes[:num_samples]
+    return (codes[:, np.newaxis] & bit_values != 0).astype(np.int64)
+
+
+def _check_flags(state_class: Type[State], flags: Sequence[str]):
+    unknown = [flag for flag in flags if flag not in state_class.STATE_COLUMNS]
+    if unknown:
+        raise ValueError(f"{state_class.__name__} has no flags {unknown}.")
+
+
+def _state_matrix(
+    state_class: Type[State],
+    flag_names: Sequence[str],
+    flags: np.ndarray,
+    num_submission_attempts: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """State matrix rows (in `state_class.STATE_COLUMNS` order) for the given vectors of `flag_names` flags.
+    Flags of the state class that are not in `flag_names` are 0."""
+    num_rows = len(flags)
+    columns = {
+        "num_submission_attempts": np.full(num_rows, num_submission_attempts),
+        # As in `HOStateC.generate_state_matrix`: at most one minute per measurement made.
+        "minutes_elapsed": rng.integers(0, flags.sum(axis=1) + 1),
+    }
+    for i, flag in enumerate(flag_names):
+        columns[flag] = flags[:, i]
+    return np.column_stack(
+        [
+            columns.get(column, np.zeros(num_rows, dtype=np.int64))
+            for column in state_class.STATE_COLUMNS
+        ]
+    )
+
+
+def iter_state_space(
+    state_class: Type[State],
+    submission_counts: Iterable[int],
+    ks: Optional[Iterable[int]] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    rng: Optional[Union[int, np.random.Generator]] = None,
+    state_space_name: str = "exhaustive",
+    flags: Sequence[str] = MEASUREMENT_FLAGS,
+) -> Iterator[StateSweep]:
+    """The exhaustive state space over `flags` (every vector of those flags with k ones for k in `ks`, for every
+    submission count; all other flags 0) as a stream of sweeps of at most `chunk_size` states."""
+    _check_flags(state_class, flags)
+    rng = as_generator(rng, "enumeration.iter_state_space")
+    num_flags = len(flags)
+    # `ks` is iterated once per submission count.
+    ks = tuple(range(num_flags + 1) if ks is None else ks)
+    for num_submission_attempts in submission_counts:
+        for flag_vectors in iter_flag_combinations(num_flags, ks, chunk_size):
+            yield StateSweep.from_matrix(
+                state_space_name,
+                _state_matrix(
+                    state_class, flags, flag_vectors, num_submission_attempts, rng
+                ),
+                state_class,
+            )
+
+
+def stratified_state_sweep(
+    state_class: Type[State],
+    samples_per_stratum: int,
+    submission_counts: Iterable[int],
+    ks: Optional[Iterable[int]] = None,
+    rng: Optional[Union[int, np.random.Generator]] = None,
+    state_space_name: str = "stratified",
+    flags: Sequence[str] = MEASUREMENT_FLAGS,
+) -> StateSweep:
+    """A sweep with `samples_per_stratum` states for every (number of measurements k among `flags`, submission
+    count) stratum. Flags not in `flags` are 0.
+
+    Strata with fewer distinct flag vectors than `samples_per_stratum` contribute all of them."""
+    _check_flags(state_class, flags)
+    rng = as_generator(rng, "enumeration.stratified_state_sweep")
+    num_flags = len(flags)
+    # `ks` is iterated once per submission count.
+    ks = tuple(range(num_flags + 1) if ks is None else ks)
+    return StateSweep.concat(
+        [
+            StateSweep.from_matrix(
+                state_space_name,
+                _state_matrix(
+                    state_class,
+                    flags,
+                    sample_flag_combinations(num_flags, k, samples_per_stratum, rng),
+                    num_submission_attempts,
+                    rng,
+                ),
+                state_class,
+            )
+            for num_submission_attempts in submission_counts
+            for k in ks
+        ]
+    )
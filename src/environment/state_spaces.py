@@ -1,19 +1,36 @@
-import random
+import hashlib
+import itertools
+import math
 from dataclasses import dataclass, field
 from typing import *
 from itertools import combinations
 
 import numpy as np
 
-random.seed(42)
-np.random.seed(42)
-rng = np.random.default_rng()
+import seeding
+
+MEASUREMENT_FLAGS = ("AP", "AF1", "AF2", "AX", "F1P", "F1F2", "F1X", "F2P", "F2X", "PX")
+
+
+def as_generator(
+    seed_or_rng: Optional[Union[int, np.random.Generator]], stream: str
+) -> np.random.Generator:
+    """A `Generator` for `seed_or_rng`. Without one, the next generator of the caller's `seeding` stream is
+    used, so that repeated calls draw new (but reproducible) states."""
+    if isinstance(seed_or_rng, np.random.Generator):
+        return seed_or_rng
+    if seed_or_rng is None:
+        return seeding.next_generator("state_spaces", stream)
+    return np.random.default_rng(seed_or_rng)
 
 
 @dataclass
 class State:
     state_space_name: str
 
+    # Names of the state variables, in the order of the columns of a state matrix / `StateSweep` table
+    STATE_COLUMNS: ClassVar[Tuple[str, ...]] = ()
+
     @property
     def state_variables(self) -> Dict[str, Any]:
         dict_vars = self.__dict__.copy()
@@ -26,13 +43,154 @@ class State:
         raise NotImplementedError
 
 
-@dataclass
+def _load_sweep_file(path: str) -> "StateSweep":
+    from environment.sweep_file import load_sweep
+
+    return load_sweep(path)
+
+
+def _sweep_file_exists(path: str) -> bool:
+    from environment.sweep_file import exists
+
+    return exists(path)
+
+
+class _StateRows(Sequence):
+    """Read-only sequence of the states of a `StateSweep`, materialized one row at a time."""
+
+    def __init__(self, sweep: "StateSweep"):
+        self._sweep = sweep
+
+    def __len__(self):
+        return len(self._sweep)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self._sweep[index])
+        return self._sweep.state(index)
+
+    def __iter__(self):
+        return iter(self._sweep)
+
+
+@dataclass(eq=False)
 class StateSweep:
+    """A sweep of states stored column-wise, as a NumPy structured array with one int64 column per state
+    variable (`state_class.STATE_COLUMNS`).
+
+    Rows only become `state_class` objects when they are accessed (`sweep[i]`, iteration or `states`).
+    Indexing with a slice, a boolean mask or an index array returns a new sweep; slices are views of the same
+    table and cost O(1). The table may be memory-mapped from a sweep file (`source`)."""
+
     state_space_name: str
-    states: List[State]
+    table: np.ndarray
+    state_class: Type[State]
+    # Sweep file the table is memory-mapped from (see `environment.sweep_file`)
+    source: Optional[str] = field(default=None, repr=False)
+
+    def __reduce_ex__(self, protocol):
+        if self.source is not None and _sweep_file_exists(self.source):
+            # Let the receiving process map the same file instead of copying the table.
+            return _load_sweep_file, (self.source,)
+        # In-memory sweeps, and sweeps whose file has been removed since it was mapped, are pickled by value.
+        return StateSweep, (
+            self.state_space_name,
+            np.asarray(self.table),
+            self.state_class,
+        )
+
+    @staticmethod
+    def dtype_for(state_class: Type[State]) -> np.dtype:
+        return np.dtype([(column, np.int64) for column in state_class.STATE_COLUMNS])
+
+    @classmethod
+    def from_matrix(
+        cls, state_space_name: str, state_matrix: np.ndarray, state_class: Type[State]
+    ) -> "StateSweep":
+        """A sweep over the rows of a 2D integer matrix whose columns follow `state_class.STATE_COLUMNS`."""
+        state_matrix = np.ascontiguousarray(state_matrix, dtype=np.int64).reshape(
+            -1, len(state_class.STATE_COLUMNS)
+        )
+        # Reinterpret every row as one record, without copying.
+        table = state_matrix.view(cls.dtype_for(state_class)).reshape(-1)
+        return cls(state_space_name, table, state_class)
+
+    @classmethod
+    def from_states(
+        cls,
+        state_space_name: str,
+        states: Iterable[State],
+        state_class: Optional[Type[State]] = None,
+    ) -> "StateSweep":
+        states = list(states)
+        state_class = state_class or type(states[0])
+        table = np.array(
+            [
+                tuple(getattr(state, column) for column in state_class.STATE_COLUMNS)
+                for state in states
+            ],
+            dtype=cls.dtype_for(state_class),
+        )
+        return cls(state_space_name, table, state_class)
+
+    @classmethod
+    def concat(
+        cls, sweeps: Sequence["StateSweep"], state_space_name: Optional[str] = None
+    ) -> "StateSweep":
+        state_class = sweeps[0].state_class
+        assert all(
+            sweep.state_class is state_class for sweep in sweeps
+        ), "Only sweeps over the same state class can be concatenated."
+        return cls(
+            state_space_name or sweeps[0].state_space_name,
+            np.concatenate([sweep.table for sweep in sweeps]),
+            state_class,
+        )
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, index) -> Union[State, "StateSweep"]:
+        if isinstance(index, (int, np.integer)):
+            return self.state(index)
+        return StateSweep(self.state_space_name, self.table[index], self.state_class)
+
+    def __iter__(self) -> Iterator[State]:
+        columns = self.table.dtype.names
+        for row in self.table.tolist():
+            yield self.state_class(**dict(zip(columns, row)))
+
+    def state(self, index: int) -> State:
+        return self.state_class(
+            **dict(zip(self.table.dtype.names, self.table[index].item()))
+        )
+
+    @property
+    def states(self) -> Sequence[State]:
+        return _StateRows(self)
+
+    def column(self, name: str) -> np.ndarray:
+        return self.table[name]
+
+    def filter(
+        self, mask: Union[np.ndarray, Callable[[np.ndarray], np.ndarray]]
+    ) -> "StateSweep":
+        """The states for which `mask` (a boolean array, or a function of the table returning one) is true."""
+        return self[mask(self.table) if callable(mask) else mask]
+
+    def renamed(self, state_space_name: str) -> "StateSweep":
+        return StateSweep(state_space_name, self.table, self.state_class)
+
+    @property
+    def fingerprint(self) -> str:
+        """Content hash of the states (independent of the sweep's name)."""
+        return hashlib.sha256(
+            f"{self.state_class.__name__}:{self.table.dtype.descr}:".encode("utf-8")
+            + np.ascontiguousarray(self.table).tobytes()
+        ).hexdigest()
 
     def describe_state(self) -> str:
-        return "\n".join([state.describe_state() for state in self.states])
+        return "\n".join([state.describe_state() for state in self])
 
 
 @dataclass
@@ -42,6 +200,11 @@ class HOStateA(State):
     time_elapsed_in_minutes: int = 0
     num_submission_attempts: int = 0
 
+    STATE_COLUMNS: ClassVar[Tuple[str, ...]] = (
+        "time_elapsed_in_minutes",
+        "num_submission_attempts",
+    )
+
     def describe_state(self) -> str:
         return f"""State:\nTIME_ELAPSED (the number of minutes that have passed since the start of the session): {self.time_elapsed_in_minutes} minutes\nNUM_SUBMISSION_ATTEMPTS (the number of times the user has submitted an answer since the start of the session): {self.num_submission_attempts}"""
 
@@ -75,144 +238,152 @@ F2P: {self.F2P} (whether the user has measured the distance between Focus 2 and
 F2X: {self.F2X} (whether the user has measured the distance between Focus 2 and the point X on the orbit)
 PX: {self.PX} (whether the user has measured the distance between Perihelion and the point X on the orbit)"""
 
+    # Order of the state variables in a state matrix row
+    STATE_COLUMNS: ClassVar[Tuple[str, ...]] = (
+        "num_submission_attempts",
+        *MEASUREMENT_FLAGS,
+    )
+
     @staticmethod
     def generate_state_from_vector(state: np.ndarray) -> "HOStateB":
-        state = state.tolist()
-        return HOStateB(
-            num_submission_attempts=state[0],
-            AP=state[1],
-            AF1=state[2],
-            AF2=state[3],
-            AX=state[4],
-            F1P=state[5],
-            F1F2=state[6],
-            F1X=state[7],
-            F2P=state[8],
-            F2X=state[9],
-            PX=state[10],
-        )
+        return HOStateB(**dict(zip(HOStateB.STATE_COLUMNS, state.tolist())))
 
     @staticmethod
-    def generate_states(num_state_vars=10, std_dev=1) -> StateSweep:
-        result_array = None
+    def _sample_measurements(
+        rng: np.random.Generator, num_state_vars: int, std_dev: float, samples_per_mean: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Per mean number of measurements 0..num_state_vars: the sampled total S (clipped to [0, n]) and
+        `samples_per_mean` rows of measurement flags drawn with probability S / n each."""
+        means = np.arange(num_state_vars + 1)
         # Sample the total number of measurements made so far (S) from a normal distribution
-        for mean in range(0, 11):
-            S = int(np.random.normal(mean, std_dev))
-            S = max(
-                0, min(S, num_state_vars)
-            )  # Ensure S is within the valid range [0, n]
-
-            # Calculate the probability p
-            p = S / num_state_vars
-
-            # Generate a random count vector that corresponds to number of measurements of *each type* so that it approximately sums up to S (binomial distribution with parameter S).
-            if result_array is None:
-                # Initialize the state space as a 2D array
-                result_array = np.hstack(
-                    (
-                        np.tile([mean], (10, 1)),
-                        np.random.binomial(1, p, (10, num_state_vars)),
-                    )
-                )
-            else:
-                # Add a new state as a new row
-                result_array = np.vstack(
-                    (
-                        result_array,
-                        np.hstack(
-                            (
-                                np.tile([mean], (10, 1)),
-                                np.random.binomial(1, p, (10, num_state_vars)),
-                            )
-                        ),
-                    )
-                )
-        # Generate state objects from row of the 2D result_array
-        return StateSweep(
-            state_space_name="binomial_prior",
-            states=[
-                HOStateB.generate_state_from_vector(state) for state in result_array
-            ],
+        totals = np.clip(
+            np.trunc(rng.normal(means, std_dev)).astype(int), 0, num_state_vars
+        )
+        p = np.repeat(totals / num_state_vars, samples_per_mean)
+        flags = (
+            rng.random((len(p), num_state_vars)) < p[:, np.newaxis]
+        ).astype(int)
+        return means, totals, flags
+
+    @staticmethod
+    def generate_state_matrix(
+        num_state_vars=10,
+        std_dev=1,
+        samples_per_mean=10,
+        rng: Optional[Union[int, np.random.Generator]] = None,
+    ) -> np.ndarray:
+        """`samples_per_mean` states per number of submission attempts 0..num_state_vars, with measurement
+        flags drawn around that many measurements. Rows follow `HOStateB.STATE_COLUMNS`."""
+        means, _, flags = HOStateB._sample_measurements(
+            as_generator(rng, "HOStateB.generate_state_matrix"),
+            num_state_vars,
+            std_dev,
+            samples_per_mean,
         )
+        return np.column_stack((np.repeat(means, samples_per_mean), flags))
 
     @staticmethod
-    def generate_thorough_state_space(ks, vector_size=10) -> StateSweep:
+    def generate_states(
+        num_state_vars=10,
+        std_dev=1,
+        rng: Optional[Union[int, np.random.Generator]] = None,
+    ) -> StateSweep:
+        return StateSweep.from_matrix(
+            "binomial_prior",
+            HOStateB.generate_state_matrix(num_state_vars, std_dev, rng=rng),
+            HOStateB,
+        )
+
+    @staticmethod
+    def generate_thorough_state_matrix(
+        ks,
+        vector_size=10,
+        rng: Optional[Union[int, np.random.Generator]] = None,
+    ) -> np.ndarray:
         """
         Generates a 2D array where each row is a vector of size 'vector_size' with exactly 'k' ones,
-        and an appended 11th element that's a random integer increasing with 'k'.
+        and a prepended element that's a random integer increasing with 'k'.
 
         Parameters:
         - ks (list[int]): Each k in ks is a number of ones in each vector.
         - vector_size (int): Size of the vector (default is 10).
+        - rng: Seed or `Generator` for the prepended values.
 
         Returns:
-        - np.ndarray: A 2D array of shape (C(vector_size, k), vector_size + 1).
+        - np.ndarray: A 2D array of shape (sum of C(vector_size, k), vector_size + 1).
         """
+        rng = as_generator(rng, "HOStateB.generate_thorough_state_matrix")
         k_results = []
         for k in ks:
             if not (0 <= k <= vector_size):
                 raise ValueError(f"k must be between 0 and {vector_size} (inclusive).")
 
-            # Step 1: Generate all combinations of positions for ones
-            index_combinations = list(combinations(range(vector_size), k))
-            num_combinations = len(index_combinations)
-
-            # Initialize the array with zeros
+            # All combinations of positions for ones, one row per combination
+            num_combinations = math.comb(vector_size, k)
+            positions = np.fromiter(
+                itertools.chain.from_iterable(combinations(range(vector_size), k)),
+                dtype=int,
+                count=num_combinations * k,
+            ).reshape(num_combinations, k)
             combinations_array = np.zeros((num_combinations, vector_size), dtype=int)
+            combinations_array[np.arange(num_combinations)[:, np.newaxis], positions] = 1
 
-            # Set ones at the specified positions
-            for idx, positions in enumerate(index_combinations):
-                combinations_array[idx, list(positions)] = 1
-
-            # Step 2: Define the increasing function for the appended element
-            def increasing_function(sum_of_ones):
-                if sum_of_ones < 2:
-                    return 0  # Return a small random integer if sum_of_ones is 0
-                else:
-                    return sum_of_ones + np.random.randint(
-                        0, int(0.3 * (sum_of_ones + 1)) + 1
-                    )
-
-            # Since sum_of_ones is always k, we can compute the appended values directly
-            appended_values = np.array(
-                [increasing_function(k) for _ in range(num_combinations)]
-            ).reshape(-1, 1)
-
-            # Concatenate the appended values to the combinations array
-            result = np.hstack((appended_values, combinations_array))
-            k_results.append(result)
-        ks_result = np.vstack(k_results)
-        return StateSweep(
-            state_space_name="thorough_k",
-            states=[HOStateB.generate_state_from_vector(row) for row in ks_result],
-        )
+            # The prepended element increases with the number of ones (always k here)
+            if k < 2:
+                appended_values = np.zeros(num_combinations, dtype=int)
+            else:
+                appended_values = k + rng.integers(
+                    0, int(0.3 * (k + 1)) + 1, size=num_combinations
+                )
+            k_results.append(np.column_stack((appended_values, combinations_array)))
+        return np.vstack(k_results)
 
     @staticmethod
-    def generate_toy_state_space(start_idx=20, num_samples=10) -> StateSweep:
-        state_sweep = HOStateB.generate_states()
-        return StateSweep(
-            state_space_name="toy_state_space",
-            states=state_sweep.states[start_idx : start_idx + num_samples],
+    def generate_thorough_state_space(
+        ks,
+        vector_size=10,
+        rng: Optional[Union[int, np.random.Generator]] = None,
+    ) -> StateSweep:
+        return StateSweep.from_matrix(
+            "thorough_k",
+            HOStateB.generate_thorough_state_matrix(ks, vector_size, rng=rng),
+            HOStateB,
         )
 
     @staticmethod
-    def generate_state_space_for_uniform_hyp() -> StateSweep:
-        states = np.array(HOStateB.generate_states().states)
-        return StateSweep(
-            state_space_name="uniform_hyp_1",
-            states=np.random.choice(states, int(0.8 * len(states)), replace=False),
+    def generate_toy_state_space(
+        start_idx=20,
+        num_samples=10,
+        rng: Optional[Union[int, np.random.Generator]] = None,
+    ) -> StateSweep:
+        state_sweep = HOStateB.generate_states(rng=rng)
+        return state_sweep[start_idx : start_idx + num_samples].renamed(
+            "toy_state_space"
         )
 
     @staticmethod
-    def generate_uniform_state_space(size: str = "small") -> StateSweep:
+    def generate_state_space_for_uniform_hyp(
+        rng: Optional[Union[int, np.random.Generator]] = None,
+    ) -> StateSweep:
+        rng = as_generator(rng, "HOStateB.generate_state_space_for_uniform_hyp")
+        states = HOStateB.generate_states(rng=rng)
+        return states[
+            rng.choice(len(states), int(0.8 * len(states)), replace=False)
+        ].renamed("uniform_hyp_1")
+
+    @staticmethod
+    def generate_uniform_state_space(
+        size: str = "small",
+        rng: Optional[Union[int, np.random.Generator]] = None,
+    ) -> StateSweep:
         if size == "tiny":
-            states = np.array(HOStateB.generate_states().states)[[0, 50, 100]]
+            states = HOStateB.generate_states(rng=rng)[[0, 50, 100]]
         elif size == "small":
-            states = np.array(HOStateB.generate_states().states)[
+            states = HOStateB.generate_states(rng=rng)[
                 [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
             ]
         elif size == "medium":
-            states = np.array(HOStateB.generate_states().states)[
+            states = HOStateB.generate_states(rng=rng)[
                 [
                     0,
                     5,
@@ -239,7 +410,7 @@ PX: {self.PX} (whether the user has measured the distance between Perihelion and
             ]
         else:
             raise ValueError
-        return StateSweep(state_space_name=f"uniform_state_space_{size}", states=states)
+        return states.renamed(f"uniform_state_space_{size}")
 
 
 @dataclass
@@ -261,80 +432,64 @@ F2P: {self.F2P} (whether the user has measured the distance between Focus 2 and
 F2X: {self.F2X} (whether the user has measured the distance between Focus 2 and the point X on the orbit)
 PX: {self.PX} (whether the user has measured the distance between Perihelion and the point X on the orbit)"""
 
+    STATE_COLUMNS: ClassVar[Tuple[str, ...]] = (
+        "num_submission_attempts",
+        "minutes_elapsed",
+        *MEASUREMENT_FLAGS,
+    )
+
     @staticmethod
     def generate_state_from_vector(state: np.ndarray) -> "HOStateC":
-        state = state.tolist()
-        return HOStateC(
-            num_submission_attempts=state[0],
-            minutes_elapsed=state[1],
-            AP=state[2],
-            AF1=state[3],
-            AF2=state[4],
-            AX=state[5],
-            F1P=state[6],
-            F1F2=state[7],
-            F1X=state[8],
-            F2P=state[9],
-            F2X=state[10],
-            PX=state[11],
+        return HOStateC(**dict(zip(HOStateC.STATE_COLUMNS, state.tolist())))
+
+    @staticmethod
+    def generate_state_matrix(
+        num_state_vars=10,
+        std_dev=1,
+        samples_per_mean=10,
+        rng: Optional[Union[int, np.random.Generator]] = None,
+    ) -> np.ndarray:
+        """Like `HOStateB.generate_state_matrix`, plus the minutes elapsed: a random integer between 0 and the
+        sampled number of measurements, shared by all states with the same number of submission attempts.
+        Rows follow `HOStateC.STATE_COLUMNS`."""
+        rng = as_generator(rng, "HOStateC.generate_state_matrix")
+        means, totals, flags = HOStateB._sample_measurements(
+            rng, num_state_vars, std_dev, samples_per_mean
+        )
+        minutes = rng.integers(0, totals + 1)
+        return np.column_stack(
+            (
+                np.repeat(means, samples_per_mean),
+                np.repeat(minutes, samples_per_mean),
+                flags,
+            )
         )
 
     @staticmethod
-    def generate_states(num_state_vars=10, std_dev=1) -> StateSweep:
-        result_array = None
-        # Sample the total number of measurements made so far (S) from a normal distribution
-        for mean in range(0, 11):
-            S = int(np.random.normal(mean, std_dev))
-            S = max(
-                0, min(S, num_state_vars)
-            )  # Ensure S is within the valid range [0, n]
-            T = np.random.randint(0, S + 1)
-
-            # Calculate the probability p
-            p = S / num_state_vars
-
-            # Generate a random count vector that corresponds to number of measurements of *each type* so that it approximately sums up to S (binomial distribution with parameter S).
-            if result_array is None:
-                # Initialize the state space as a 2D array
-                result_array = np.hstack(
-                    (
-                        np.tile([mean], (10, 1)),
-                        np.tile([T], (10, 1)),
-                        np.random.binomial(1, p, (10, num_state_vars)),
-                    )
-                )
-            else:
-                # Add a new state as a new row
-                result_array = np.vstack(
-                    (
-                        result_array,
-                        np.hstack(
-                            (
-                                np.tile([mean], (10, 1)),
-                                np.tile([T], (10, 1)),
-                                np.random.binomial(1, p, (10, num_state_vars)),
-                            )
-                        ),
-                    )
-                )
-        # Generate state objects from row of the 2D result_array
-        return StateSweep(
-            state_space_name="binomial_prior",
-            states=[
-                HOStateC.generate_state_from_vector(state) for state in result_array
-            ],
+    def generate_states(
+        num_state_vars=10,
+        std_dev=1,
+        rng: Optional[Union[int, np.random.Generator]] = None,
+    ) -> StateSweep:
+        return StateSweep.from_matrix(
+            "binomial_prior",
+            HOStateC.generate_state_matrix(num_state_vars, std_dev, rng=rng),
+            HOStateC,
         )
 
     @staticmethod
-    def generate_uniform_state_space(size: str = "small") -> StateSweep:
+    def generate_uniform_state_space(
+        size: str = "small",
+        rng: Optional[Union[int, np.random.Generator]] = None,
+    ) -> StateSweep:
         if size == "tiny":
-            states = np.array(HOStateC.generate_states().states)[[0, 50, 100]]
+            states = HOStateC.generate_states(rng=rng)[[0, 50, 100]]
         elif size == "small":
-            states = np.array(HOStateC.generate_states().states)[
+            states = HOStateC.generate_states(rng=rng)[
                 [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
             ]
         elif size == "medium":
-            states = np.array(HOStateC.generate_states().states)[
+            states = HOStateC.generate_states(rng=rng)[
                 [
                     0,
                     5,
@@ -361,4 +516,4 @@ PX: {self.PX} (whether the user has measured the distance between Perihelion and
             ]
         else:
             raise ValueError
-        return StateSweep(state_space_name=f"uniform_state_space_{size}", states=states)
+        return states.renamed(f"uniform_state_space_{size}")
@@ -0,0 +1,92 @@
+"""On-disk format for state sweeps: the columnar state table as a `.npy` file, memory-mapped when loaded, plus a
+JSON sidecar with the sweep's name and state class.
+
+Every process that loads the same sweep file maps the same pages instead of holding its own copy, and a
+loaded sweep is pickled by path (by value once its file is gone), so handing it to a worker process does not
+copy the states either.
+"""
+
+import importlib
+import json
+import os
+from typing import *
+
+import numpy as np
+
+from environment.state_spaces import State, StateSweep
+
+SWEEP_FILE_FORMAT_VERSION = 1
+
+
+def _paths(path: Text) -> Tuple[Text, Text]:
+    return f"{path}.npy", f"{path}.json"
+
+
+def exists(path: Text) -> bool:
+    # The sidecar is written last, so its presence means the sweep file is complete.
+    return all(os.path.exists(p) for p in _paths(path))
+
+
+def save_sweep(sweep: StateSweep, path: Text):
+    """Write `sweep` to `<path>.npy` and `<path>.json`. Both files are replaced atomically."""
+    table_path, sidecar_path = _paths(path)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Temporary names keep the .npy extension, which np.lib.format does not require but tools expect.
+    tmp_table_path = f"{path}.{os.getpid()}.tmp.npy"
+    tmp_sidecar_path = f"{path}.{os.getpid()}.tmp.json"
+    try:
+        table = np.lib.format.open_memmap(
+            tmp_table_path, mode="w+", dtype=sweep.table.dtype, shape=sweep.table.shape
+        )
+        table[:] = sweep.table
+        table.flush()
+        del table
+        os.replace(tmp_table_path, table_path)
+
+        sidecar = {
+            "format_version": SWEEP_FILE_FORMAT_VERSION,
+            "state_space_name": sweep.state_space_name,
+            "state_class": f"{sweep.state_class.__module__}:{sweep.state_class.__qualname__}",
+            "columns": list(sweep.table.dtype.names),
+            "num_states": len(sweep),
+        }
+        with open(tmp_sidecar_path, "w") as f:
+            json.dump(sidecar, f, indent=2)
+        os.replace(tmp_sidecar_path, sidecar_path)
+    finally:
+        # Only left behind if writing failed
+        for tmp_path in [tmp_table_path, tmp_sidecar_path]:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+
+def _state_class(name: Text) -> Type[State]:
+    module_name, _, qualname = name.partition(":")
+    state_class = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        state_class = getattr(state_class, attr)
+    return state_class
+
+
+def load_sweep(path: Text, mmap: bool = True) -> StateSweep:
+    """Load a sweep written by `save_sweep`, memory-mapping its table read-only unless `mmap=False`."""
+    table_path, sidecar_path = _paths(path)
+    with open(sidecar_path) as f:
+        sidecar = json.load(f)
+    if sidecar["format_version"] != SWEEP_FILE_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported sweep file format {sidecar['format_version']} in {sidecar_path}."
+        )
+    state_class = _state_class(sidecar["state_class"])
+    table = np.load(table_path, mmap_mode="r" if mmap else None)
+    if list(table.dtype.names) != list(state_class.STATE_COLUMNS):
+        raise ValueError(
+            f"Columns of {table_path} don't match {state_class.__name__}.STATE_COLUMNS."
+        )
+    return StateSweep(
+        sidecar["state_space_name"],
+        table,
+        state_class,
+        source=path if mmap else None,
+    )
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import *
+
+import seeding
+from environment import sweep_file
+from environment.state_spaces import StateSweep
+
+# Bump whenever a state generator changes what it produces for the same parameters and seed, so that stale
+# sweeps on disk are not picked up.
+SWEEP_GENERATOR_VERSION = 4
+
+
+@dataclass
+class _SweepSpec:
+    generator: Callable[..., StateSweep]
+    params: dict
+    # Names of the `seeding` stream the sweep is drawn from
+    stream: Tuple[Text, ...]
+
+    def key(self, root_seed: int) -> Text:
+        payload = json.dumps(
+            {
+                "generator": f"{self.generator.__module__}.{self.generator.__qualname__}",
+                "params": self.params,
+                "stream": list(self.stream),
+                "root_seed": root_seed,
+                "version": SWEEP_GENERATOR_VERSION,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class StateSweepRegistry:
+    """Named state sweeps that are generated on first access and cached on disk as memory-mapped sweep files.
+
+    Each generator is called with `rng=seeding.generator("state_sweep", name, root_seed=root_seed)`: every
+    sweep has its own independent stream, only depends on its generator, parameters, name and root seed, and
+    every process loads the exact same states from `cache_dir`. Changing `root_seed` switches every sweep to
+    its stream under the new seed."""
+
+    def __init__(self, cache_dir: Text, root_seed: Optional[int] = None):
+        self.cache_dir = cache_dir
+        self.root_seed = seeding.ROOT_SEED if root_seed is None else root_seed
+        self._specs: Dict[Text, _SweepSpec] = {}
+        self._sweeps: Dict[Tuple[Text, int], StateSweep] = {}
+        self._lock = threading.RLock()
+
+    def register(
+        self,
+        name: Text,
+        generator: Callable[..., StateSweep],
+        stream: Optional[Tuple[Text, ...]] = None,
+        **params,
+    ):
+        """Register a sweep drawn from the `seeding` stream `stream` (default: `("state_sweep", name)`)."""
+        self._specs[name] = _SweepSpec(
+            generator,
+            params,
+            tuple(stream) if stream is not None else ("state_sweep", name),
+        )
+
+    def __contains__(self, name: Text) -> bool:
+        return name in self._specs
+
+    def names(self) -> List[Text]:
+        return list(self._specs.keys())
+
+    def path(self, name: Text) -> Text:
+        """Sweep file path (without extension) of a registered sweep."""
+        return os.path.join(
+            self.cache_dir, f"{name}-{self._specs[name].key(self.root_seed)}"
+        )
+
+    def get(self, name: Text) -> StateSweep:
+        with self._lock:
+            key = (name, self.root_seed)
+            if key not in self._sweeps:
+                self._sweeps[key] = self._load_or_generate(name)
+            return self._sweeps[key]
+
+    def _load_or_generate(self, name: Text) -> StateSweep:
+        path = self.path(name)
+        if not sweep_file.exists(path):
+            spec = self._specs[name]
+            sweep_file.save_sweep(
+                spec.generator(
+                    rng=seeding.generator(*spec.stream, root_seed=self.root_seed),
+                    **spec.params,
+                ),
+                path,
+            )
+        # Load even a freshly generated sweep from disk, so that every process maps the same file.
+        return sweep_file.load_sweep(path)
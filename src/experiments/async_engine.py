@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import *
+
+import config
+from experiments.instrumentation import TRACER
+
+
+@dataclass
+class RateLimit:
+    """Per-model request and token budgets (per minute). `None` means unlimited."""
+
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+
+
+class _TokenBucket:
+    """Token bucket that hands out reservations instead of blocking.
+
+    The balance may go negative; the caller sleeps until its reservation is covered. This keeps the bucket
+    free of event-loop-bound primitives, so one bucket can be shared by every engine in the process."""
+
+    def __init__(self, capacity_per_minute: int):
+        self.capacity = capacity_per_minute
+        self.rate = capacity_per_minute / 60
+        self.level = capacity_per_minute
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` out of the bucket and return how many seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(
+                self.capacity, self.level + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            self.level -= min(amount, self.capacity)
+            return 0.0 if self.level >= 0 else -self.level / self.rate
+
+
+_BUCKETS: Dict[Tuple[Text, Text], _TokenBucket] = {}
+_BUCKETS_LOCK = threading.Lock()
+
+
+def _bucket(model_name: Text, kind: Text, capacity: Optional[int]):
+    if capacity is None:
+        return None
+    with _BUCKETS_LOCK:
+        key = (model_name, kind)
+        if key not in _BUCKETS or _BUCKETS[key].capacity != capacity:
+            _BUCKETS[key] = _TokenBucket(capacity)
+        return _BUCKETS[key]
+
+
+def rate_limit_for(model_name: Text) -> RateLimit:
+    return RateLimit(**config.MODEL_RATE_LIMITS.get(model_name, {}))
+
+
+def estimate_tokens(inputs: Any) -> int:
+    """Rough token count of a request (~4 characters per token) plus the expected completion length."""
+    if isinstance(inputs, dict):
+        text = "".join(str(value) for value in inputs.values())
+    else:
+        text = str(inputs)
+    return len(text) // 4 + config.COMPLETION_TOKENS_ESTIMATE
+
+
+class AsyncPredictionEngine:
+    """Runs a chain over many inputs concurrently with `chain.ainvoke`, within a model's rate limits.
+
+    Outputs are returned in the same order as the inputs. Like `evaluate`, a prediction that still fails after
+    `max_retries` retries doesn't stop the others: its output is `None`, and its error is kept in `errors` at the
+    same position."""
+
+    def __init__(
+        self,
+        model_name: Text,
+        max_concurrency: int = config.PREDICTION_MAX_CONCURRENCY,
+        rate_limit: Optional[RateLimit] = None,
+        max_retries: int = 3,
+        retry_backoff_seconds: float = 2.0,
+    ):
+        self.model_name = model_name
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit or rate_limit_for(model_name)
+        self.max_retries = max_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+        # Error of each input of the last `predict`/`apredict` call (`None` for successful predictions)
+        self.errors: List[Optional[Text]] = []
+
+    async def _wait_for_budget(self, inputs: Any):
+        request_bucket = _bucket(
+            self.model_name, "requests", self.rate_limit.requests_per_minute
+        )
+        token_bucket = _bucket(
+            self.model_name, "tokens", self.rate_limit.tokens_per_minute
+        )
+        delay = max(
+            request_bucket.reserve(1) if request_bucket else 0.0,
+            token_bucket.reserve(estimate_tokens(inputs)) if token_bucket else 0.0,
+        )
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _predict_one(
+        self,
+        chain,
+        inputs: Any,
+        semaphore: asyncio.Semaphore,
+        errors: List[Optional[Text]],
+        index: int,
+    ):
+        async with semaphore:
+            with TRACER.span("prediction", model=self.model_name, retries=0) as span:
+                for attempt in range(self.max_retries + 1):
+                    await self._wait_for_budget(inputs)
+                    try:
+                        return await chain.ainvoke(inputs)
+                    except Exception as e:
+                        if attempt == self.max_retries:
+                            span.set(error=repr(e))
+                            errors[index] = repr(e)
+                            print(
+                                f"Prediction failed ({e!r}) after {self.max_retries} retries, skipping it"
+                            )
+                            return None
+                        span.increment("retries")
+                        print(
+                            f"Prediction failed ({e!r}), retrying ({attempt + 1}/{self.max_retries})"
+                        )
+                        await asyncio.sleep(self.retry_backoff_seconds * 2**attempt)
+
+    async def apredict(self, chain, inputs_list: Iterable[Any]) -> List[Any]:
+        inputs_list = list(inputs_list)
+        errors = [None] * len(inputs_list)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        outputs = await asyncio.gather(
+            *[
+                self._predict_one(chain, inputs, semaphore, errors, i)
+                for i, inputs in enumerate(inputs_list)
+            ]
+        )
+        self.errors = errors
+        return outputs
+
+    def predict(self, chain, inputs_list: Iterable[Any]) -> List[Any]:
+        """Blocking version of `apredict`. Async callers should await `apredict` instead."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.apredict(chain, inputs_list))
+        # `asyncio.run` can't be nested in a running loop (e.g. in a notebook); run on a loop of our own.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(
+                asyncio.run, self.apredict(chain, inputs_list)
+            ).result()
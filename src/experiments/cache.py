@@ -0,0 +1,303 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import *
+
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import LLMResult
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import RunnableLambda
+
+import config
+from experiments.checkpoint import connect
+from experiments.instrumentation import TRACER
+
+
+def completion_fingerprint(
+    prompt_text: Text,
+    model_name: Text,
+    temperature: float,
+    seed: Optional[int],
+    top_p: Optional[float],
+    n: int = 1,
+) -> Text:
+    """Content address of a completion request."""
+    request = {
+        "prompt": prompt_text,
+        "model": model_name,
+        "temperature": temperature,
+        "seed": seed,
+        "top_p": top_p,
+    }
+    if n != 1:
+        request["n"] = n
+    payload = json.dumps(
+        request,
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CacheStats:
+    """Hits and misses of the lookups made through one `chat_completion_runnable`, e.g. one experiment's."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0,
+        }
+
+    def __str__(self):
+        return str(self.as_dict())
+
+
+class CompletionCache:
+    """Persistent, size-bounded store of LLM completions keyed by request fingerprint.
+
+    Entries are evicted least-recently-used first, `eviction_batch` at a time, once `max_entries` is exceeded.
+    The number of entries is tracked in memory and only recounted when an eviction looks due. Cache hits don't
+    write anything; their access times are written back `access_batch` at a time and before every eviction."""
+
+    def __init__(
+        self,
+        path: Text = config.COMPLETION_CACHE_PATH,
+        max_entries: int = config.COMPLETION_CACHE_MAX_ENTRIES,
+        eviction_batch: int = config.COMPLETION_CACHE_EVICTION_BATCH,
+        access_batch: int = config.COMPLETION_CACHE_ACCESS_BATCH,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.eviction_batch = eviction_batch
+        self.access_batch = access_batch
+        # Lookups over the lifetime of the cache, across every experiment that uses it
+        self.stats = CacheStats()
+        self._pending_accesses: Dict[Text, float] = {}
+        self._lock = threading.Lock()
+        # Sweep workers share the cache file.
+        self._conn = connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS completions_last_access "
+            "ON completions (last_access)"
+        )
+        self._conn.commit()
+        self._num_entries = self._count()
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def get(self, key: Text) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            self.stats.record(hit=row is not None)
+            if row is None:
+                return None
+            self._pending_accesses[key] = time.time()
+            if len(self._pending_accesses) >= self.access_batch:
+                self._write_accesses()
+                self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: Text, value: dict):
+        with self._lock:
+            self._pending_accesses.pop(key, None)
+            value = json.dumps(value)
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO completions (key, value, last_access) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            if cursor.rowcount > 0:
+                self._num_entries += 1
+            else:
+                self._conn.execute(
+                    "UPDATE completions SET value = ?, last_access = ? WHERE key = ?",
+                    (value, time.time(), key),
+                )
+            if self._num_entries > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def flush(self):
+        """Write back the access times of recent cache hits."""
+        with self._lock:
+            self._write_accesses()
+            self._conn.commit()
+
+    def _write_accesses(self):
+        if self._pending_accesses:
+            self._conn.executemany(
+                "UPDATE completions SET last_access = ? WHERE key = ?",
+                [
+                    (last_access, key)
+                    for key, last_access in self._pending_accesses.items()
+                ],
+            )
+            self._pending_accesses.clear()
+
+    def _evict(self):
+        # Other processes may share the cache file, so recount before deleting anything.
+        self._num_entries = self._count()
+        if self._num_entries > self.max_entries:
+            self._write_accesses()
+            num_evicted = self._num_entries - self.max_entries + self.eviction_batch
+            self._conn.execute(
+                "DELETE FROM completions WHERE key IN ("
+                "SELECT key FROM completions ORDER BY last_access ASC LIMIT ?)",
+                (num_evicted,),
+            )
+            self._num_entries = self._count()
+
+    def __len__(self):
+        with self._lock:
+            return self._count()
+
+    def as_runnable(
+        self,
+        chat_model,
+        n: int = 1,
+        usage: Optional["TokenUsage"] = None,
+        cache_stats: Optional[CacheStats] = None,
+    ) -> RunnableLambda:
+        """Wrap `chat_model` so that it is only called on cache misses.
+
+        Meant to sit between the prompt template and the parser in a chain. See `chat_completion_runnable`."""
+        return chat_completion_runnable(
+            chat_model, n=n, cache=self, usage=usage, cache_stats=cache_stats
+        )
+
+
+@dataclass
+class TokenUsage:
+    """Token counts accumulated over the completion requests that actually reached the provider."""
+
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_prompt_tokens: int = 0
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def add(self, token_usage: dict):
+        """Add the `usage` block of an OpenAI chat completion response."""
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += token_usage.get("prompt_tokens") or 0
+            self.completion_tokens += token_usage.get("completion_tokens") or 0
+            self.cached_prompt_tokens += (
+                token_usage.get("prompt_tokens_details") or {}
+            ).get("cached_tokens") or 0
+
+    @property
+    def cached_prompt_token_share(self) -> float:
+        return (
+            self.cached_prompt_tokens / self.prompt_tokens
+            if self.prompt_tokens > 0
+            else 0
+        )
+
+
+def chat_completion_runnable(
+    chat_model,
+    n: int = 1,
+    cache: Optional[CompletionCache] = None,
+    usage: Optional[TokenUsage] = None,
+    cache_stats: Optional[CacheStats] = None,
+) -> RunnableLambda:
+    """Runnable that sends a prompt to `chat_model`, optionally through a completion cache.
+
+    With `n > 1`, N choices are requested in a single call (the OpenAI `n` parameter) and a list of N messages is
+    returned instead of a single message. Token usage of requests that miss the cache is added to `usage`, and
+    the cache's hits and misses are counted in `cache_stats`."""
+    model_kwargs = getattr(chat_model, "model_kwargs", {}) or {}
+
+    def key_for(prompt_value: PromptValue) -> Text:
+        return completion_fingerprint(
+            prompt_value.to_string(),
+            chat_model.model_name,
+            chat_model.temperature,
+            model_kwargs.get("seed"),
+            model_kwargs.get("top_p"),
+            n=n,
+        )
+
+    def to_value(result: LLMResult) -> dict:
+        value = {
+            "choices": [generation.text for generation in result.generations[0]],
+            "usage": (result.llm_output or {}).get("token_usage", {}),
+        }
+        if usage is not None:
+            usage.add(value["usage"])
+        return value
+
+    def record_usage(span, value: dict):
+        span.set(
+            prompt_tokens=value["usage"].get("prompt_tokens", 0),
+            completion_tokens=value["usage"].get("completion_tokens", 0),
+        )
+
+    def to_output(value: dict) -> Union[AIMessage, List[AIMessage]]:
+        # Entries written before multi-choice support only hold a single `content`.
+        choices = value["choices"] if "choices" in value else [value["content"]]
+        messages = [AIMessage(content=choice) for choice in choices]
+        return messages if n > 1 else messages[0]
+
+    def invoke(prompt_value: PromptValue):
+        with TRACER.span("llm_call", model=chat_model.model_name, n=n) as span:
+            key = key_for(prompt_value) if cache is not None else None
+            value = cache.get(key) if cache is not None else None
+            span.set(cache_hit=value is not None)
+            if cache is not None and cache_stats is not None:
+                cache_stats.record(hit=value is not None)
+            if value is None:
+                value = to_value(
+                    chat_model.generate([prompt_value.to_messages()], n=n)
+                )
+                if cache is not None:
+                    cache.put(key, value)
+                record_usage(span, value)
+            return to_output(value)
+
+    async def ainvoke(prompt_value: PromptValue):
+        with TRACER.span("llm_call", model=chat_model.model_name, n=n) as span:
+            key = key_for(prompt_value) if cache is not None else None
+            # Cache lookups and writes are blocking SQLite calls; keep them off the event loop.
+            value = (
+                await asyncio.to_thread(cache.get, key) if cache is not None else None
+            )
+            span.set(cache_hit=value is not None)
+            if cache is not None and cache_stats is not None:
+                cache_stats.record(hit=value is not None)
+            if value is None:
+                value = to_value(
+                    await chat_model.agenerate([prompt_value.to_messages()], n=n)
+                )
+                if cache is not None:
+                    await asyncio.to_thread(cache.put, key, value)
+                record_usage(span, value)
+            return to_output(value)
+
+    return RunnableLambda(invoke, afunc=ainvoke, name="ChatCompletion")
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import *
+
+import config
+
+
+def _json_default(value):
+    # numpy scalars and arrays end up in the metrics
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+def connect(path: Text) -> sqlite3.Connection:
+    """Connection to a SQLite database that several processes write to at once.
+
+    Writers wait up to `config.SQLITE_BUSY_TIMEOUT_SECONDS` for each other instead of failing with "database is
+    locked", and write-ahead logging lets readers proceed during a write."""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(
+        path, timeout=config.SQLITE_BUSY_TIMEOUT_SECONDS, check_same_thread=False
+    )
+    conn.execute(
+        f"PRAGMA busy_timeout = {int(config.SQLITE_BUSY_TIMEOUT_SECONDS * 1000)}"
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def fingerprint(*parts: Any) -> Text:
+    """Stable content address of dataclass-based objects (hypotheses, learner models, states, ...).
+
+    Uses `repr`, not `describe`/`__str__`: some hypotheses randomize their description on every call."""
+    return hashlib.sha256(
+        "\x1f".join(repr(part) for part in parts).encode("utf-8")
+    ).hexdigest()
+
+
+def state_key(state_variables: dict) -> Text:
+    return hashlib.sha256(
+        json.dumps(state_variables, sort_keys=True, default=_json_default).encode(
+            "utf-8"
+        )
+    ).hexdigest()
+
+
+class CheckpointStore:
+    """Local record of finished work, so that an interrupted sweep can be rerun without repeating LLM calls.
+
+    Stores the summarized result of every completed experiment run, keyed by run (hypothesis, learner model,
+    state sweep and prediction settings) and target learner characteristic level, and every raw completion,
+    additionally keyed by state and repetition. Each write is committed immediately."""
+
+    def __init__(self, path: Text = config.CHECKPOINT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "run_key TEXT NOT NULL, level INTEGER NOT NULL, value TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (run_key, level))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "run_key TEXT NOT NULL, level INTEGER NOT NULL, state_key TEXT NOT NULL, repetition INTEGER NOT NULL, "
+            "next_action TEXT, completion TEXT, "
+            "PRIMARY KEY (run_key, level, state_key, repetition))"
+        )
+        self._conn.commit()
+
+    def get_results(self, run_key: Text) -> Dict[int, dict]:
+        """Stored results of a run by level."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT level, value FROM results WHERE run_key = ?", (run_key,)
+            ).fetchall()
+        return {level: json.loads(value) for level, value in rows}
+
+    def put_result(self, run_key: Text, level: int, result: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (run_key, level, value, created_at) VALUES (?, ?, ?, ?)",
+                (run_key, level, json.dumps(result, default=_json_default), time.time()),
+            )
+            self._conn.commit()
+
+    def put_completions(self, run_key: Text, level: int, predictions):
+        """Store the raw completions of `predictions` (a `PredictionResults`), one row per state and repetition."""
+        completions = predictions.completions or [None] * len(predictions.examples)
+        repetitions = {}
+        rows = []
+        for example, next_action, completion in zip(
+            predictions.examples, predictions.next_actions, completions
+        ):
+            key = state_key(
+                {
+                    name: value
+                    for name, value in (example.metadata or {}).items()
+                    if name not in ["experiment_id", "content_hash"]
+                }
+            )
+            if not isinstance(next_action, list):
+                next_action, completion = [next_action], [completion]
+            for label, text in zip(next_action, completion or [None] * len(next_action)):
+                repetition = repetitions.get(key, 0)
+                repetitions[key] = repetition + 1
+                rows.append((run_key, level, key, repetition, label, text))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO completions "
+                "(run_key, level, state_key, repetition, next_action, completion) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def get_completions(self, run_key: Text, level: int) -> List[Tuple[Text, int, Text, Text]]:
+        """(state key, repetition, next action, completion) rows of one level of a run."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT state_key, repetition, next_action, completion FROM completions "
+                "WHERE run_key = ? AND level = ? ORDER BY state_key, repetition",
+                (run_key, level),
+            ).fetchall()
+
+    def clear(self, run_key: Text):
+        with self._lock:
+            self._conn.execute("DELETE FROM results WHERE run_key = ?", (run_key,))
+            self._conn.execute("DELETE FROM completions WHERE run_key = ?", (run_key,))
+            self._conn.commit()
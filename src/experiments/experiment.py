@@ -1,31 +1,60 @@
+import hashlib
 import itertools
+import json
 import os
-import random
+import queue
+import threading
 import time
+import uuid
+from collections import defaultdict
 from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from functools import partial
 from typing import *
 
-random.seed(22)
-
 import pandas as pd
 from dotenv import load_dotenv
-from langchain import hub
 from langchain_community.llms.fake import FakeListLLM
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import AIMessage
-from langchain_openai import ChatOpenAI
-from langsmith import Client
+from langchain_core.runnables import RunnableLambda
 from langsmith.evaluation import evaluate, evaluate_existing
 from langsmith.schemas import Example, Run
 
 load_dotenv(".env.secret")
 load_dotenv(".env")
 
+import config
 from environment.action_spaces import ActionSpace
 from environment.state_spaces import State, StateSweep
+from experiments.async_engine import AsyncPredictionEngine
+from experiments.cache import CacheStats, TokenUsage, chat_completion_runnable
+from experiments.instrumentation import TRACER
+from experiments.metrics import action_metrics
+from experiments.prompt_layout import PROMPT_LAYOUTS, prefix_key, prefix_stable_prompt
+from experiments.resources import RESOURCE_POOL
 from learner.learners import Learner, LearnerCharacteristicModel
 
 
+# Metadata that differs between runs of the same grid, and so is left out of a sample's content hash
+_UNHASHED_METADATA = ["experiment_id", "content_hash"]
+
+
+def _content_hash(sample: dict) -> Text:
+    """Hash of a sample's inputs and stable metadata; the same vignette hashes the same in every run."""
+    content = {
+        "inputs": sample["inputs"],
+        "metadata": {
+            name: value
+            for name, value in sample["metadata"].items()
+            if name not in _UNHASHED_METADATA
+        },
+    }
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
 @dataclass
 class Vignette:
     """Corresponds a single row in a dataset (akin to a vignette used in psychological research)."""
@@ -53,18 +82,18 @@ class Vignette:
                     else ""
                 ),
                 "persistence_model": (
-                    self.learner.persistence_model.describe()
+                    self.learner.persistence_model.description
                     if self.learner.persistence_model
                     else ""
                 ),
                 "geometry_proficiency_model": (
-                    self.learner.geometry_proficiency_model.describe()
+                    self.learner.geometry_proficiency_model.description
                     if self.learner.geometry_proficiency_model
                     else ""
                 ),
                 "state": self.state.describe_state(),
                 "state_sweep_name": self.state_sweep_name,
-                "action_space": self.learner.action_space.describe_action_space(),
+                "action_space": self.learner.action_space.description,
             },
             "outputs": {},
             # For filtering
@@ -79,11 +108,49 @@ class Vignette:
                 "action_space_name": self.learner.action_space.action_space_name,
                 "persistence_level": self.learner.persistence_level,
                 "geometry_proficiency_level": self.learner.geometry_proficiency_level,
-                **self.state.__dict__,
+                **self.state.state_variables,
             },
         }
 
 
+@dataclass
+class PredictionResults:
+    """Predicted next actions, aligned with the dataset examples they were predicted for."""
+
+    experiment_name: Text
+    examples: List[Example]
+    next_actions: List[Text]
+    token_usage: Optional[TokenUsage] = None
+    # Raw model responses the next actions were parsed from
+    completions: Optional[List[Text]] = None
+
+    def split_by_levels(
+        self, level_pairs: List[Tuple[Optional[int], Optional[int]]]
+    ) -> Dict[Tuple[Optional[int], Optional[int]], "PredictionResults"]:
+        """Split by the (persistence_level, geometry_proficiency_level) pair in the example metadata.
+
+        Token usage is only known for the whole batch, so the split results have none."""
+        predictions_by_levels = {
+            levels: PredictionResults(self.experiment_name, [], [], None, [])
+            for levels in level_pairs
+        }
+        for i, (example, next_action) in enumerate(
+            zip(self.examples, self.next_actions)
+        ):
+            level_predictions = predictions_by_levels[
+                (
+                    example.metadata.get("persistence_level"),
+                    example.metadata.get("geometry_proficiency_level"),
+                )
+            ]
+            level_predictions.examples.append(example)
+            level_predictions.next_actions.append(next_action)
+            level_predictions.completions.append(
+                self.completions[i] if self.completions is not None else None
+            )
+        return predictions_by_levels
+
+
 @dataclass
 class Experiment:
     experiment_id: Text
@@ -102,16 +169,27 @@ class Experiment:
     state_sweep: StateSweep
     action_space: ActionSpace
 
+    use_completion_cache: bool = True
+    # Explicit (persistence_level, geometry_proficiency_level) pairs; defaults to the product of the two lists.
+    learner_levels: Optional[List[Tuple[Optional[int], Optional[int]]]] = None
+    # "hub" uses the prompt pulled from `prompt_name` as is; "prefix_stable" moves the state to the end of that
+    # prompt (see `prefix_stable_prompt`) and sends vignettes that share a prefix together.
+    prompt_layout: Text = "hub"
+
     def __post_init__(self):
+        assert self.prompt_layout in PROMPT_LAYOUTS
         # Initialize client
-        self.client = Client()
+        self.client = RESOURCE_POOL.langsmith_client()
         # Verify that all model types are the same
         # Load components
-        self.prompt = hub.pull(self.prompt_name)
-        self.chat_model = ChatOpenAI(
-            model=self.model_name,
-            temperature=self.temperature,
-            model_kwargs={"seed": 420, "top_p": 0.01},
+        self.prompt = RESOURCE_POOL.prompt(self.prompt_name)
+        if self.prompt_layout == "prefix_stable":
+            self.prompt = prefix_stable_prompt(self.prompt)
+        self.chat_model = RESOURCE_POOL.chat_model(
+            self.model_name, self.temperature, seed=420, top_p=0.01
+        )
+        self.completion_cache = (
+            RESOURCE_POOL.completion_cache() if self.use_completion_cache else None
         )
 
     @property
@@ -120,175 +198,510 @@ class Experiment:
         return {
             "persistence_model": [self.persistence_model],
             "geometry_proficiency_model": [self.geometry_proficiency_model],
-            "persistence_levels": (
-                self.persistence_levels if self.persistence_levels else [None]
-            ),
-            "geometry_proficiency_levels": (
-                self.geometry_proficiency_levels
-                if self.geometry_proficiency_levels
-                else [None]
+            "learner_levels": (
+                self.learner_levels
+                if self.learner_levels
+                else list(
+                    itertools.product(
+                        (
+                            self.persistence_levels
+                            if self.persistence_levels
+                            else [None]
+                        ),
+                        (
+                            self.geometry_proficiency_levels
+                            if self.geometry_proficiency_levels
+                            else [None]
+                        ),
+                    )
+                )
             ),
             "states": self.state_sweep.states,
             "state_sweep_name": [self.state_sweep.state_space_name],
             "action_spaces": [self.action_space],
         }
 
+    @TRACER.traced("predict_over_dataset")
     def _predict_over_dataset(
         self,
         dataset: Text,
         dataset_filters: dict,
         num_generations_per_sample: int = 1,
         experiment_prefix: Text = None,
-        fake_llm: bool = False,
-    ):
-        """Predict over the dataset and log the results."""
+        fake_llm: Union[bool, BaseChatModel] = False,
+        max_concurrency: Optional[int] = None,
+        n_completions_per_request: bool = False,
+        content_hashes: Optional[Collection[Text]] = None,
+    ) -> "PredictionResults":
+        """Predict over the dataset and log the results.
+
+        If `content_hashes` is set, only the examples matching `dataset_filters` with one of those content hashes
+        are predicted over.
 
-        def extract_last_label(text, labels):
-            last_position = -1
-            last_label = None
+        If `max_concurrency` is set, predictions are made concurrently by the async engine instead of `evaluate`.
+        If `n_completions_per_request` is set, the `num_generations_per_sample` generations of each sample are
+        requested as N choices of a single completion request instead of N separate requests. `fake_llm` can be
+        `True` for a canned two-response fake, or a chat model (e.g. `SimulatedChatModel`) to use instead of the
+        real one."""
 
-            # Iterate through the list of candidate labels
-            for label in labels:
-                # Find the last occurrence of the current label in the text
-                position = text.rfind(label)
+        def extract_action_label(
+            action_space: "ActionSpace", message: Union["AIMessage", List["AIMessage"]]
+        ) -> dict:
+            """The predicted action label(s) along with the raw completion(s) they were parsed from."""
+            messages = message if isinstance(message, list) else [message]
+            texts = [
+                choice if isinstance(choice, str) else choice.content
+                for choice in messages
+            ]
+            labels = action_space.matcher.last_labels(texts, default="UNPREDICTED")
+            if isinstance(message, list):
+                return {"output": labels, "completion": texts}
+            return {"output": labels[0], "completion": texts[0]}
 
-                # Update the last label and position if this label occurs later
-                if position > last_position:
-                    last_position = position
-                    last_label = label
+        # With `n_completions_per_request`, all generations of a sample come back from a single request.
+        choices_per_request = (
+            num_generations_per_sample if n_completions_per_request else 1
+        )
+        num_repetitions = 1 if n_completions_per_request else num_generations_per_sample
 
-            return last_label
+        # Repeated samples at a non-zero temperature must not collapse onto one cached completion.
+        use_cache = self.completion_cache is not None and (
+            num_repetitions == 1 or self.temperature == 0
+        )
 
-        def extract_action_label(
-            action_space: "ActionSpace", message: "AIMessage"
-        ) -> Text:
-            text = message if isinstance(message, str) else message.content
-            return (
-                extract_last_label(text, action_space.actions.keys()) or "UNPREDICTED"
-            )
+        token_usage = TokenUsage()
+        # The completion cache is shared by every experiment in the process; count this experiment's lookups.
+        cache_stats = CacheStats()
 
         # Run evaluation for the first time
-        if fake_llm:
+        if isinstance(fake_llm, BaseChatModel):
+            # Simulated backends are never cached: their point is to exercise the whole request path.
             chain = (
                 self.prompt
-                | FakeListLLM(responses=["MEASURE-A-P", "MEASURE-F1-F2"])
+                | chat_completion_runnable(
+                    fake_llm, n=choices_per_request, usage=token_usage
+                )
+                | partial(extract_action_label, self.action_space)
+            )
+        elif fake_llm:
+            fake_model = FakeListLLM(responses=["MEASURE-A-P", "MEASURE-F1-F2"])
+            chain = (
+                self.prompt
+                | (
+                    fake_model
+                    if choices_per_request == 1
+                    else RunnableLambda(
+                        lambda prompt_value: fake_model.batch(
+                            [prompt_value] * choices_per_request
+                        )
+                    )
+                )
                 | partial(extract_action_label, self.action_space)
             )
         else:
             chain = (
                 self.prompt
-                | self.chat_model
+                | chat_completion_runnable(
+                    self.chat_model,
+                    n=choices_per_request,
+                    cache=self.completion_cache if use_cache else None,
+                    usage=token_usage,
+                    cache_stats=cache_stats,
+                )
                 | partial(extract_action_label, self.action_space)
             )
-        results = evaluate(
-            chain.invoke,
-            data=self.client.list_examples(
-                dataset_name=dataset, metadata=dataset_filters
-            ),
-            experiment_prefix=experiment_prefix,
-            num_repetitions=num_generations_per_sample,
+        examples = list(
+            self.client.list_examples(dataset_name=dataset, metadata=dataset_filters)
         )
-        return results
+        if content_hashes is not None:
+            examples = [
+                example
+                for example in examples
+                if (example.metadata or {}).get("content_hash") in content_hashes
+            ]
+        if self.prompt_layout == "prefix_stable":
+            examples.sort(key=lambda example: prefix_key(example.inputs))
+        if max_concurrency is None:
+            results = evaluate(
+                chain.invoke,
+                data=examples,
+                experiment_prefix=experiment_prefix,
+                num_repetitions=num_repetitions,
+            )
+            experiment_name = results.experiment_name
+            repeated_examples = [result["example"] for result in results._results]
+            # Runs that errored out have no outputs.
+            outputs = [result["run"].outputs for result in results._results]
+        else:
+            # Repetitions are laid out the same way `evaluate(..., num_repetitions=...)` does it.
+            repeated_examples = examples * num_repetitions
+            engine = AsyncPredictionEngine(
+                model_name=self.model_name, max_concurrency=max_concurrency
+            )
+            started_at = datetime.now(timezone.utc)
+            outputs = engine.predict(
+                chain, [example.inputs for example in repeated_examples]
+            )
+            experiment_name = self._log_predictions(
+                repeated_examples,
+                outputs,
+                started_at,
+                experiment_prefix,
+                errors=engine.errors,
+            )
 
-    def _calculate_aggregate_metrics(
-        self, existing_experiment_id: Text, action_space: ActionSpace
-    ):
-        """Get the distribution of the next action in the existing experiment."""
+        def output_field(output: Optional[dict], key: Text, repetition: int):
+            if not output:
+                return None
+            return output[key] if choices_per_request == 1 else output[key][repetition]
 
-        def percentage_of_action(
-            runs: list[Run], examples: list[Example], action_label: Text
-        ) -> dict:
-            """Calculate the percentage of a particular action in the list of runs."""
-            action_count = 0
-            for i, run in enumerate(runs):
-                if run.outputs is None:
-                    continue
-                if run.outputs["output"] == action_label:
-                    action_count += 1
-            print(f"{action_label.lower()}_percentage = {action_count / len(runs)}")
-            return {
-                "key": f"{action_label.lower()}_percentage",
-                "score": action_count / len(runs),
-            }
-
-        results = evaluate_existing(
-            existing_experiment_id,
-            summary_evaluators=[
-                partial(percentage_of_action, action_label=action_label)
-                for action_label in action_space.actions.keys()
-            ]
-            + [
-                action_space.productive_measurement_percentage,
-                action_space.unproductive_measurement_percentage,
+        # With several choices per request, there is one entry per generation, laid out like `num_repetitions`
+        # so downstream metrics are unchanged.
+        predictions = PredictionResults(
+            experiment_name,
+            [
+                example
+                for _ in range(choices_per_request)
+                for example in repeated_examples
+            ],
+            [
+                output_field(output, "output", repetition)
+                for repetition in range(choices_per_request)
+                for output in outputs
+            ],
+            token_usage,
+            [
+                output_field(output, "completion", repetition)
+                for repetition in range(choices_per_request)
+                for output in outputs
             ],
         )
+        if use_cache:
+            self.completion_cache.flush()
+            print(f"Completion cache: {cache_stats}")
+        if token_usage.requests > 0:
+            print(
+                f"Prompt tokens: {token_usage.prompt_tokens} ({token_usage.cached_prompt_token_share:.1%} cached)"
+            )
+        return predictions
 
-        return {
-            result.key: result.score for result in results._summary_results["results"]
-        }
+    def _log_predictions(
+        self,
+        examples: List[Example],
+        outputs: List[dict],
+        started_at: datetime,
+        experiment_prefix: Text = None,
+        errors: Optional[List[Optional[Text]]] = None,
+    ) -> Text:
+        """Record predictions made outside of `evaluate` as a LangSmith experiment; returns its name.
 
-    def _create_evaluation_dataset(self):
-        """Create a LangSmith dataset with all possible combinations of the experiment parameters."""
-        client = Client()
-        try:
-            dataset = client.create_dataset(self.dataset_name)
-        except Exception as e:
-            print(f"Using existing dataset: {self.dataset_name}")
-            dataset = client.read_dataset(dataset_name=self.dataset_name)
-        vignettes = [
-            Vignette(
-                experiment_id=self.experiment_id,
-                learner=Learner(
-                    action_space=action_space,
-                    persistence_level=persistence_level,
-                    geometry_proficiency_level=geometry_proficiency_level,
-                    persistence_model=persistence_model,
-                    geometry_proficiency_model=geometry_proficiency_model,
-                ),
-                state_sweep_name=state_sweep_name,
-                state=state,
+        Predictions without an output are logged as errored runs, with their error from `errors` if given.
+
+        The experiment is a project that references the dataset, with one run per prediction, ingested in batches
+        of `config.DATASET_UPLOAD_BATCH_SIZE` runs."""
+        experiment_name = f"{experiment_prefix or ''}{uuid.uuid4().hex[:8]}"
+        project = self.client.create_project(
+            experiment_name,
+            reference_dataset_id=examples[0].dataset_id if examples else None,
+            metadata={"model_name": self.model_name, "prompt_name": self.prompt_name},
+        )
+        ended_at = datetime.now(timezone.utc)
+        runs = []
+        errors = errors or [None] * len(examples)
+        for example, output, error in zip(examples, outputs, errors):
+            run_id = uuid.uuid4()
+            runs.append(
+                {
+                    "id": run_id,
+                    "trace_id": run_id,
+                    "dotted_order": f"{started_at:%Y%m%dT%H%M%S%fZ}{run_id}",
+                    "name": "AsyncPredictionEngine",
+                    "run_type": "chain",
+                    "inputs": example.inputs,
+                    "outputs": output or {},
+                    # Runs that errored out have no outputs.
+                    "error": None if output else error or "No output",
+                    "reference_example_id": example.id,
+                    "session_id": project.id,
+                    "start_time": started_at,
+                    "end_time": ended_at,
+                }
             )
-            for persistence_model, geometry_proficiency_model, persistence_level, geometry_proficiency_level, state, state_sweep_name, action_space in itertools.product(
-                *self.experiment_dict.values()
+        batch_size = config.DATASET_UPLOAD_BATCH_SIZE
+        for batch_start in range(0, len(runs), batch_size):
+            self.client.batch_ingest_runs(
+                create=runs[batch_start : batch_start + batch_size]
             )
-        ]
-        for vignette in vignettes:
-            langsmith_sample = vignette.as_langsmith_sample
-            client.create_example(
-                inputs=langsmith_sample["inputs"],
-                outputs=langsmith_sample["outputs"],
-                metadata=langsmith_sample["metadata"],
-                dataset_id=dataset.id,
+        return experiment_name
+
+    @TRACER.traced("calculate_aggregate_metrics")
+    def _calculate_aggregate_metrics(
+        self,
+        predictions: PredictionResults,
+        action_space: ActionSpace,
+        upload: bool = False,
+    ):
+        """Get the distribution of the next action in the experiment.
+
+        Metrics are computed locally from the predictions. With `upload=True` they are also attached to the
+        LangSmith experiment as summary feedback."""
+        metrics = action_metrics(
+            predictions.next_actions,
+            action_space,
+            metadata=[example.metadata or {} for example in predictions.examples],
+        )
+        for key, score in metrics.items():
+            print(f"{key} = {score}")
+
+        if upload:
+            # Give LangSmith a moment to ingest the runs before attaching summary feedback to them.
+            time.sleep(1)
+            evaluate_existing(
+                predictions.experiment_name,
+                summary_evaluators=[
+                    lambda runs, examples: {
+                        "results": [
+                            {"key": key, "score": score}
+                            for key, score in metrics.items()
+                        ]
+                    }
+                ],
             )
 
-    def run(self, num_generations_per_sample: int = 1, fake_llm: bool = False) -> dict:
-        """Create, predict over, and log the next action distribution for the evaluation dataset."""
-        self._create_evaluation_dataset()
-        experiment = self._predict_over_dataset(
-            self.dataset_name,
-            {"experiment_id": self.experiment_id},
-            experiment_prefix="experiment-",
-            num_generations_per_sample=num_generations_per_sample,
-            fake_llm=fake_llm,
+        return metrics
+
+    @TRACER.traced("create_evaluation_dataset")
+    def _create_evaluation_dataset(self) -> Set[Text]:
+        """Create a LangSmith dataset with all possible combinations of the experiment parameters.
+
+        Returns the content hashes of the experiment's examples."""
+        try:
+            dataset = self.client.create_dataset(self.dataset_name)
+        except Exception as e:
+            print(f"Using existing dataset: {self.dataset_name}")
+            dataset = self.client.read_dataset(dataset_name=self.dataset_name)
+        return self._upload_samples(
+            dataset.id,
+            (vignette.as_langsmith_sample for vignette in self._iter_vignettes()),
         )
-        next_actions = [
-            experiment._results[i]["run"].outputs["output"]
-            for i in range(len(experiment._results))
-        ]
 
-        time.sleep(1)
+    def _iter_vignettes(self) -> Iterator[Vignette]:
+        """Every combination of the experiment parameters, in `itertools.product` order, built one at a time
+        (states are materialized from the sweep as they are reached)."""
+        experiment_dict = self.experiment_dict
+        for persistence_model, geometry_proficiency_model, (
+            persistence_level,
+            geometry_proficiency_level,
+        ) in itertools.product(
+            experiment_dict["persistence_model"],
+            experiment_dict["geometry_proficiency_model"],
+            experiment_dict["learner_levels"],
+        ):
+            for state in experiment_dict["states"]:
+                for state_sweep_name, action_space in itertools.product(
+                    experiment_dict["state_sweep_name"], experiment_dict["action_spaces"]
+                ):
+                    yield Vignette(
+                        experiment_id=self.experiment_id,
+                        learner=Learner(
+                            action_space=action_space,
+                            persistence_level=persistence_level,
+                            geometry_proficiency_level=geometry_proficiency_level,
+                            persistence_model=persistence_model,
+                            geometry_proficiency_model=geometry_proficiency_model,
+                        ),
+                        state_sweep_name=state_sweep_name,
+                        state=state,
+                    )
 
+    def _upload_samples(self, dataset_id, samples: Iterable[dict]) -> Set[Text]:
+        """Upload samples in batches, skipping those already present in the dataset; returns the content hashes of
+        all `samples`.
+
+        Each sample is tagged with a `content_hash` of its inputs and stable metadata (not the experiment id).
+        Identical samples within one grid are kept apart by their occurrence number, so re-running an experiment
+        never duplicates rows, even under a new experiment id, but a grid that legitimately repeats a vignette
+        still gets every copy.
+
+        `samples` is consumed lazily. Batches are uploaded by a background thread while the next ones are
+        rendered; at most `config.DATASET_UPLOAD_QUEUE_BATCHES` batches wait for upload at a time, so rendering
+        blocks whenever the upload falls behind. Rendered samples therefore take a bounded amount of memory, but
+        the content hashes do not: one is kept for every sample and for every example already in the dataset
+        (about 100 bytes each)."""
+        existing_hashes = {
+            example.metadata.get("content_hash")
+            for example in self.client.list_examples(dataset_id=dataset_id)
+            if example.metadata
+        }
+        upload_queue = queue.Queue(maxsize=config.DATASET_UPLOAD_QUEUE_BATCHES)
+        upload_errors = []
+
+        def upload():
+            while (batch := upload_queue.get()) is not None:
+                if upload_errors:
+                    # Keep draining so that the producer never blocks on a dead uploader.
+                    continue
+                try:
+                    self.client.create_examples(
+                        inputs=[sample["inputs"] for sample in batch],
+                        outputs=[sample["outputs"] for sample in batch],
+                        metadata=[sample["metadata"] for sample in batch],
+                        dataset_id=dataset_id,
+                    )
+                except Exception as e:
+                    upload_errors.append(e)
+
+        uploader = threading.Thread(target=upload, daemon=True)
+        uploader.start()
+
+        occurrences = defaultdict(int)
+        content_hashes = set()
+        num_samples, num_new_samples = 0, 0
+        batch = []
+        try:
+            for sample in samples:
+                if upload_errors:
+                    break
+                num_samples += 1
+                content_hash = _content_hash(sample)
+                occurrences[content_hash] += 1
+                content_hash = f"{content_hash}-{occurrences[content_hash]}"
+                content_hashes.add(content_hash)
+                if content_hash in existing_hashes:
+                    continue
+                sample["metadata"]["content_hash"] = content_hash
+                batch.append(sample)
+                num_new_samples += 1
+                if len(batch) == config.DATASET_UPLOAD_BATCH_SIZE:
+                    upload_queue.put(batch)
+                    batch = []
+            if batch and not upload_errors:
+                upload_queue.put(batch)
+        finally:
+            upload_queue.put(None)
+            uploader.join()
+        if upload_errors:
+            raise upload_errors[0]
+        print(
+            f"Uploaded {num_new_samples} new examples ({num_samples - num_new_samples} already in dataset)"
+        )
+        return content_hashes
+
+    def _summarize(
+        self,
+        predictions: PredictionResults,
+        persistence_levels: List[int],
+        geometry_proficiency_levels: List[int],
+        upload_metrics: bool = False,
+    ) -> dict:
         return {
-            "experiment_id": experiment.experiment_name,
+            "experiment_id": predictions.experiment_name,
             "action_space": self.action_space.action_space_name,
-            "persistence_levels": self.persistence_levels,
-            "geometry_proficiency_levels": self.geometry_proficiency_levels,
+            "persistence_levels": persistence_levels,
+            "geometry_proficiency_levels": geometry_proficiency_levels,
             "persistence_model": str(self.persistence_model),
             "geometry_proficiency_model": str(self.geometry_proficiency_model),
             "model": self.model_name,
             "state_sweep_name": self.state_sweep.state_space_name,
-            "next_actions": next_actions,
+            "next_actions": predictions.next_actions,
+            # Unknown (None) for predictions split out of a larger batch
+            "cached_prompt_token_share": (
+                predictions.token_usage.cached_prompt_token_share
+                if predictions.token_usage is not None
+                else None
+            ),
             **self._calculate_aggregate_metrics(
-                experiment.experiment_name, self.action_space
+                predictions, self.action_space, upload=upload_metrics
             ),
         }
+
+    def _create_and_predict(
+        self,
+        num_generations_per_sample: int = 1,
+        fake_llm: Union[bool, BaseChatModel] = False,
+        max_concurrency: Optional[int] = None,
+        n_completions_per_request: bool = False,
+    ) -> PredictionResults:
+        content_hashes = self._create_evaluation_dataset()
+        # Examples uploaded by an earlier run of the same grid carry that run's experiment id, so the
+        # experiment's examples are picked by content hash.
+        return self._predict_over_dataset(
+            self.dataset_name,
+            {
+                "state_sweep_name": self.state_sweep.state_space_name,
+                "action_space_name": self.action_space.action_space_name,
+            },
+            content_hashes=content_hashes,
+            experiment_prefix="experiment-",
+            num_generations_per_sample=num_generations_per_sample,
+            fake_llm=fake_llm,
+            max_concurrency=max_concurrency,
+            n_completions_per_request=n_completions_per_request,
+        )
+
+    def run(
+        self,
+        num_generations_per_sample: int = 1,
+        fake_llm: Union[bool, BaseChatModel] = False,
+        max_concurrency: Optional[int] = None,
+        upload_metrics: bool = False,
+        n_completions_per_request: bool = False,
+        on_predictions: Optional[Callable[[Tuple, PredictionResults], None]] = None,
+    ) -> dict:
+        """Create, predict over, and log the next action distribution for the evaluation dataset.
+
+        `on_predictions` is called with the experiment's level pairs and its predictions, e.g. to checkpoint them."""
+        predictions = self._create_and_predict(
+            num_generations_per_sample=num_generations_per_sample,
+            fake_llm=fake_llm,
+            max_concurrency=max_concurrency,
+            n_completions_per_request=n_completions_per_request,
+        )
+        if on_predictions is not None:
+            on_predictions(tuple(self.experiment_dict["learner_levels"]), predictions)
+        return self._summarize(
+            predictions,
+            self.persistence_levels,
+            self.geometry_proficiency_levels,
+            upload_metrics=upload_metrics,
+        )
+
+    def run_per_level(
+        self,
+        num_generations_per_sample: int = 1,
+        fake_llm: Union[bool, BaseChatModel] = False,
+        max_concurrency: Optional[int] = None,
+        n_completions_per_request: bool = False,
+        on_predictions: Optional[Callable[[Tuple, PredictionResults], None]] = None,
+    ) -> Dict[Text, dict]:
+        """Like `run`, but split the results by learner level pair.
+
+        All level pairs are uploaded and predicted over as a single experiment. The predictions are then split
+        by the `persistence_level`/`geometry_proficiency_level` example metadata into one result per pair, each
+        shaped like the output of `run` for an experiment with just that pair, except that token usage is only
+        reported once, for the whole batch, and the per-pair `cached_prompt_token_share` is `None`.
+        `on_predictions` is called with each level pair and its predictions."""
+        predictions = self._create_and_predict(
+            num_generations_per_sample=num_generations_per_sample,
+            fake_llm=fake_llm,
+            max_concurrency=max_concurrency,
+            n_completions_per_request=n_completions_per_request,
+        )
+        predictions_by_levels = predictions.split_by_levels(
+            self.experiment_dict["learner_levels"]
+        )
+        if on_predictions is not None:
+            for levels, level_predictions in predictions_by_levels.items():
+                on_predictions(levels, level_predictions)
+
+        return {
+            f"{self.experiment_id}-p{persistence_level}-gp{geometry_proficiency_level}": self._summarize(
+                level_predictions,
+                [persistence_level],
+                [geometry_proficiency_level],
+            )
+            for (
+                persistence_level,
+                geometry_proficiency_level,
+            ), level_predictions in predictions_by_levels.items()
+        }
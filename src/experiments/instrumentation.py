@@ -0,0 +1,171 @@
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import *
+
+import config
+
+_current_span_id = contextvars.ContextVar("current_span_id", default=None)
+
+
+class Span:
+    """A timed section of work with free-form attributes (token counts, retries, ...)."""
+
+    def __init__(
+        self,
+        tracer: "Tracer",
+        name: Text,
+        span_id: int,
+        parent_id: Optional[int],
+        attributes: dict,
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = None
+        self.wall_seconds = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def increment(self, attribute: Text, amount: int = 1):
+        self.attributes[attribute] = self.attributes.get(attribute, 0) + amount
+
+    def __enter__(self):
+        self._token = _current_span_id.set(self.span_id)
+        self.start = time.time()
+        self._perf_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wall_seconds = time.perf_counter() - self._perf_start
+        _current_span_id.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = repr(exc)
+        self.tracer._record(self)
+        return False
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "wall_seconds": self.wall_seconds,
+            **self.attributes,
+        }
+
+
+class _NullSpan:
+    """Shared stand-in returned while tracing is disabled; every operation is a no-op."""
+
+    def set(self, **attributes):
+        pass
+
+    def increment(self, attribute: Text, amount: int = 1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """Collects spans around the stages of an experiment and exports them per session.
+
+    While disabled, `span` returns a shared no-op object, so instrumented code pays for little more than an
+    attribute lookup."""
+
+    def __init__(self, enabled: bool = False, trace_dir: Text = config.TRACE_DIR):
+        self.enabled = enabled
+        self.trace_dir = trace_dir
+        self.spans = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def span(self, name: Text, **attributes) -> Union[Span, _NullSpan]:
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, next(self._ids), _current_span_id.get(), attributes)
+
+    def _record(self, span: Span):
+        with self._lock:
+            self.spans.append(span.as_dict())
+
+    def traced(self, name: Text, session: bool = False):
+        """Decorator that runs every call of the function inside a span (or a whole `session`)."""
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with self.session(name) if session else self.span(name):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    @contextmanager
+    def session(self, name: Text):
+        """Export the spans recorded inside this block as JSON lines and print a summary table."""
+        if not self.enabled:
+            yield
+            return
+        with self._lock:
+            first_span = len(self.spans)
+        try:
+            with self.span(name):
+                yield
+        finally:
+            with self._lock:
+                spans = self.spans[first_span:]
+            os.makedirs(self.trace_dir, exist_ok=True)
+            # Sweep workers (and sessions in other threads) may finish within the same second.
+            path = os.path.join(
+                self.trace_dir,
+                f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl",
+            )
+            with open(path, "x") as f:
+                for span in spans:
+                    f.write(json.dumps(span, default=str) + "\n")
+            print(summary_table(spans))
+            print(f"Trace written to {path}")
+
+
+def summary_table(spans: List[dict]) -> Text:
+    """Per-span-name totals of calls, wall time, tokens and retries."""
+    totals = defaultdict(lambda: defaultdict(float))
+    for span in spans:
+        row = totals[span["name"]]
+        row["calls"] += 1
+        row["wall_seconds"] += span["wall_seconds"] or 0
+        for key in ["prompt_tokens", "completion_tokens", "retries"]:
+            row[key] += span.get(key, 0) or 0
+
+    header = f"{'span':<32} {'calls':>7} {'total s':>10} {'mean s':>9} {'prompt tok':>11} {'compl. tok':>11} {'retries':>8}"
+    lines = [header, "-" * len(header)]
+    for name, row in sorted(totals.items(), key=lambda item: -item[1]["wall_seconds"]):
+        lines.append(
+            f"{name:<32} {int(row['calls']):>7} {row['wall_seconds']:>10.2f} {row['wall_seconds'] / row['calls']:>9.3f} "
+            f"{int(row['prompt_tokens']):>11} {int(row['completion_tokens']):>11} {int(row['retries']):>8}"
+        )
+    return "\n".join(lines)
+
+
+TRACER = Tracer(enabled=config.INSTRUMENTATION_ENABLED)
@@ -3,11 +3,9 @@ from typing import *
 from typing import Tuple
 
 import config
+import seeding
 from environment.action_spaces import ActionSpace
 from environment.state_spaces import StateSweep
-import random
-
-random.seed(42)
 
 
 @dataclass
@@ -18,6 +16,9 @@ class Hypothesis:
     action_space: ActionSpace
     stat_test_kwargs: Dict[Text, Any]
 
+    # Set to False for hypotheses whose description is randomized, so that it is never memoised.
+    deterministic_description: ClassVar[bool] = True
+
     @property
     def state_sweep(self):
         raise NotImplementedError
@@ -142,7 +143,6 @@ class UniformDistributionUncalibrated(Hypothesis):
             )
             expected_frequency = len(predicted_next_actions) / len(unique_values)
             expected_frequencies = np.full(len(unique_values), expected_frequency)
-            breakpoint()
             return chisquare(observed_frequencies, f_exp=expected_frequencies)
         raise ValueError("No experiments found.")
 
@@ -179,17 +179,27 @@ class MonotonicCalibratedI(MonotonicUncalibrated):
 @dataclass
 class UniformCalibratedF(UniformDistributionUncalibrated):
 
+    deterministic_description: ClassVar[bool] = False
+
+    def _shuffled_behavior_actions(self) -> List[Text]:
+        # Each description draws from the hypothesis's own stream, so it only depends on how many descriptions
+        # of this hypothesis were rendered before (per run, see `seeding.reset`), not on other hypotheses.
+        rng = seeding.next_generator(
+            "hypothesis_description", self.behavior_name, self.learner_characteristic
+        )
+        return [
+            self.behavior_actions[i] for i in rng.permutation(len(self.behavior_actions))
+        ]
+
     def __str__(self):
 
         def behavior_actions_list_str():
-            behavior_actions = self.behavior_actions.copy()
-            random.shuffle(behavior_actions)
-            return ", ".join([f"'{action}'" for action in behavior_actions])
+            return ", ".join(
+                [f"'{action}'" for action in self._shuffled_behavior_actions()]
+            )
 
         def first_random_action():
-            behavior_actions = self.behavior_actions.copy()
-            random.shuffle(behavior_actions)
-            return behavior_actions[0]
+            return self._shuffled_behavior_actions()[0]
 
         return f"We know for a fact that learners with {self.learner_characteristic.lower()} of 1 mindlessly pick the following action: {first_random_action()}. When picking an action, do not use your commonsense reasoning, just blindly pick this action. Trust me."
 
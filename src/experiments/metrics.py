@@ -0,0 +1,52 @@
+from typing import *
+
+from environment.action_spaces import ActionSpace, HOActionSpace
+
+
+def action_metrics(
+    next_actions: List[Optional[Text]],
+    action_space: ActionSpace,
+    metadata: Optional[List[dict]] = None,
+) -> Dict[Text, float]:
+    """Compute every `<action>_percentage` and the productive/unproductive measurement ratios in one pass.
+
+    Produces the same keys and scores as the `percentage_of_action`, `productive_measurement_percentage` and
+    `unproductive_measurement_percentage` summary evaluators. `metadata` holds the example metadata of each
+    prediction (used to discount measurements that were already made in the given state)."""
+    action_counts = {action_label: 0 for action_label in action_space.actions.keys()}
+    is_ho_action_space = isinstance(action_space, HOActionSpace)
+    productive_action_labels = (
+        set(action_space.productive_action_labels) if is_ho_action_space else set()
+    )
+    productive_actions = 0
+    measure_actions = 0
+    for i, action_label in enumerate(next_actions):
+        if action_label is None:
+            continue
+        if action_label in action_counts:
+            action_counts[action_label] += 1
+        if is_ho_action_space and action_space.is_measure_action(action_label):
+            measure_actions += 1
+            already_measured = (
+                metadata is not None and metadata[i].get(action_label, 0) == 1
+            )
+            if action_label in productive_action_labels and not already_measured:
+                productive_actions += 1
+
+    num_runs = len(next_actions)
+    metrics = {
+        f"{action_label.lower()}_percentage": (
+            count / num_runs if num_runs > 0 else 0
+        )
+        for action_label, count in action_counts.items()
+    }
+    if is_ho_action_space:
+        metrics["productive_actions_ratio"] = (
+            productive_actions / measure_actions if measure_actions > 0 else 0
+        )
+        metrics["unproductive_actions_ratio"] = (
+            (measure_actions - productive_actions) / measure_actions
+            if measure_actions > 0
+            else 0
+        )
+    return metrics
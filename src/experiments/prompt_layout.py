@@ -0,0 +1,78 @@
+import string
+from typing import *
+
+from langchain_core.prompts import (
+    AIMessagePromptTemplate,
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    SystemMessagePromptTemplate,
+)
+
+PROMPT_LAYOUTS = ["hub", "prefix_stable"]
+
+# Inputs that are identical for every vignette of an experiment, in the order vignettes are grouped by. The
+# learner levels only change between levels of a sweep, so they come right after them.
+INVARIANT_INPUTS = [
+    "action_space",
+    "persistence_model",
+    "geometry_proficiency_model",
+]
+LEVEL_INPUTS = [
+    "persistence_level_str",
+    "geometry_proficiency_level_str",
+]
+
+# Inputs that differ between the vignettes of one experiment
+VIGNETTE_INPUTS = ["state"]
+
+_LAYOUT_MESSAGE_TYPES = (
+    SystemMessagePromptTemplate,
+    HumanMessagePromptTemplate,
+    AIMessagePromptTemplate,
+)
+
+
+def _template_variables(template: Text) -> Set[Text]:
+    return {
+        name for _, name, _, _ in string.Formatter().parse(template) if name is not None
+    }
+
+
+def prefix_stable_prompt(prompt: ChatPromptTemplate) -> ChatPromptTemplate:
+    """`prompt` with every paragraph that uses a vignette input (the state) moved, in order, into a final human
+    message, so that everything shared across vignettes comes first and consecutive requests share the longest
+    possible prompt prefix (which providers cache). All other paragraphs keep their message and order.
+
+    Raises `ValueError` if a message that uses a vignette input is not a plain f-string system, human or AI
+    message, or if no message uses one."""
+    messages, moved = [], []
+    for message in prompt.messages:
+        if not set(VIGNETTE_INPUTS) & set(message.input_variables):
+            messages.append(message)
+            continue
+        if not (
+            isinstance(message, _LAYOUT_MESSAGE_TYPES)
+            and message.prompt.template_format == "f-string"
+        ):
+            raise ValueError(
+                f"Can't lay out a {type(message).__name__} prompt message prefix-stable."
+            )
+        kept = []
+        for paragraph in message.prompt.template.split("\n\n"):
+            if set(VIGNETTE_INPUTS) & _template_variables(paragraph):
+                moved.append(paragraph)
+            else:
+                kept.append(paragraph)
+        if kept:
+            messages.append(type(message).from_template("\n\n".join(kept)))
+    if not moved:
+        raise ValueError(
+            f"The prompt uses none of {VIGNETTE_INPUTS}; it has no prefix-stable layout."
+        )
+    messages.append(HumanMessagePromptTemplate.from_template("\n\n".join(moved)))
+    return ChatPromptTemplate.from_messages(messages)
+
+
+def prefix_key(inputs: dict) -> Tuple[Text, ...]:
+    """Sort key that groups vignettes sharing a prompt prefix, longest shared part first."""
+    return tuple(str(inputs.get(key, "")) for key in INVARIANT_INPUTS + LEVEL_INPUTS)
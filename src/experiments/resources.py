@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+from typing import *
+
+from langchain import hub
+from langchain_core.load import dumpd, load
+from langchain_openai import ChatOpenAI
+from langsmith import Client
+
+import config
+from experiments.cache import CompletionCache
+from experiments.checkpoint import CheckpointStore
+
+
+class ResourcePool:
+    """Process-wide pool of prompts, LLM clients, LangSmith clients, completion caches and checkpoint stores.
+
+    Experiments share these so that only the first experiment in a process pays for pulling prompts and
+    opening connection pools."""
+
+    def __init__(self, prompt_cache_dir: Text = config.PROMPT_CACHE_DIR):
+        self.prompt_cache_dir = prompt_cache_dir
+        self._prompts = {}
+        self._chat_models = {}
+        self._langsmith_client = None
+        self._completion_cache = None
+        self._checkpoint_store = None
+        self._lock = threading.RLock()
+
+    def _prompt_path(self, prompt_name: Text) -> Text:
+        owner_repo, _, commit = prompt_name.partition(":")
+        return os.path.join(
+            self.prompt_cache_dir,
+            owner_repo.replace("/", "__"),
+            f"{commit or 'latest'}.json",
+        )
+
+    def prompt(self, prompt_name: Text):
+        """Pull a prompt from the hub, caching it in memory and on disk by name and commit.
+
+        `prompt_name` may be pinned to a commit (`owner/repo:commit`). Unpinned prompts are cached as `latest`;
+        delete the cached file to pick up a newer version."""
+        with self._lock:
+            if prompt_name in self._prompts:
+                return self._prompts[prompt_name]
+            path = self._prompt_path(prompt_name)
+            if os.path.exists(path):
+                with open(path) as f:
+                    prompt = load(json.load(f))
+            else:
+                prompt = hub.pull(prompt_name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w") as f:
+                    json.dump(dumpd(prompt), f)
+                commit = (getattr(prompt, "metadata", None) or {}).get(
+                    "lc_hub_commit_hash"
+                )
+                if commit and ":" not in prompt_name:
+                    # Also file the prompt under its resolved commit so that pinned lookups hit the cache.
+                    with open(self._prompt_path(f"{prompt_name}:{commit}"), "w") as f:
+                        json.dump(dumpd(prompt), f)
+            self._prompts[prompt_name] = prompt
+            return prompt
+
+    def chat_model(self, model_name: Text, temperature: float, **model_kwargs):
+        """One `ChatOpenAI` per (model, temperature, model kwargs), whose HTTP connections are kept alive."""
+        key = (model_name, temperature, json.dumps(model_kwargs, sort_keys=True))
+        with self._lock:
+            if key not in self._chat_models:
+                self._chat_models[key] = ChatOpenAI(
+                    model=model_name,
+                    temperature=temperature,
+                    model_kwargs=model_kwargs,
+                )
+            return self._chat_models[key]
+
+    def langsmith_client(self) -> Client:
+        with self._lock:
+            if self._langsmith_client is None:
+                self._langsmith_client = Client()
+            return self._langsmith_client
+
+    def completion_cache(self) -> CompletionCache:
+        with self._lock:
+            if self._completion_cache is None:
+                self._completion_cache = CompletionCache()
+            return self._completion_cache
+
+    def checkpoint_store(self) -> CheckpointStore:
+        with self._lock:
+            if self._checkpoint_store is None:
+                self._checkpoint_store = CheckpointStore()
+            return self._checkpoint_store
+
+
+RESOURCE_POOL = ResourcePool()
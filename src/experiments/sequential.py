@@ -0,0 +1,176 @@
+import math
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import *
+
+import numpy as np
+
+from environment.state_spaces import StateSweep
+
+
+@dataclass
+class SequentialTestConfig:
+    """Settings for testing a hypothesis in waves and stopping once the result is decided.
+
+    Each of the `num_waves` waves widens the sweep to a larger share of the levels and states. The null
+    hypothesis is rejected as soon as the p-value drops below `alpha / num_waves` (Bonferroni spending over the
+    looks, so repeated testing doesn't inflate the false-positive rate). The sweep is abandoned for futility
+    once the raw p-value exceeds `futility_p_value` after `min_waves` waves, or once `max_llm_calls` is used
+    up."""
+
+    num_waves: int = 4
+    alpha: float = 0.05
+    futility_p_value: Optional[float] = None
+    min_waves: int = 2
+    max_llm_calls: Optional[int] = None
+    min_levels: int = 3
+
+    @property
+    def alpha_per_wave(self) -> float:
+        return self.alpha / self.num_waves
+
+    def adjusted_p_value(self, p_value: float) -> float:
+        """Bonferroni-adjusted p-value, to compare against `alpha` rather than `alpha_per_wave`."""
+        return float(np.minimum(1.0, p_value * self.num_waves))
+
+
+@dataclass
+class SequentialTestReport:
+    waves_run: int
+    llm_calls: int
+    full_sweep_llm_calls: int
+    stop_reason: Text
+    # Significance level each wave was tested at
+    alpha_per_wave: float = math.nan
+    # (levels run, states run per level, statistic, raw p-value) after each wave
+    history: List[Tuple[int, int, float, float]] = field(default_factory=list)
+
+    @property
+    def llm_calls_saved(self) -> int:
+        return self.full_sweep_llm_calls - self.llm_calls
+
+    def __str__(self):
+        return f"Stopped after {self.waves_run} wave(s) ({self.stop_reason}): {self.llm_calls}/{self.full_sweep_llm_calls} LLM calls, {self.llm_calls_saved} saved."
+
+
+def coarse_to_fine(num_items: int) -> List[int]:
+    """Indices ordered so that every prefix is spread as evenly as possible over the whole range."""
+    if num_items <= 2:
+        return list(range(num_items))
+    order = [0, num_items - 1]
+    intervals = [(0, num_items - 1)]
+    while intervals:
+        next_intervals = []
+        for low, high in intervals:
+            if high - low < 2:
+                continue
+            middle = (low + high) // 2
+            order.append(middle)
+            next_intervals += [(low, middle), (middle, high)]
+        intervals = next_intervals
+    return order
+
+
+def run_sequential_test(
+    tgt_hypothesis,
+    level_pairs: List[Tuple[Optional[int], Optional[int]]],
+    state_sweep: StateSweep,
+    make_experiment: Callable,
+    sequential_config: SequentialTestConfig,
+    calls_per_vignette: int = 1,
+    predict_kwargs: Optional[dict] = None,
+    stat_test_kwargs: Optional[dict] = None,
+) -> Tuple[float, float, SequentialTestReport]:
+    """Run `tgt_hypothesis.statistical_test` on a sweep that grows in waves until the result is decided.
+
+    Returns the statistic and the Bonferroni-adjusted p-value of the last wave (see
+    `SequentialTestConfig.adjusted_p_value`), and a report with the per-wave alpha and the raw p-values.
+
+    `make_experiment(level_pairs, state_sweep)` builds the experiment for some level pairs and a subset of
+    states. In every wave, the levels that need the same new states are run as one fused experiment."""
+    predict_kwargs = predict_kwargs or {}
+    stat_test_kwargs = stat_test_kwargs or {}
+    num_waves = sequential_config.num_waves
+
+    level_order = [level_pairs[i] for i in coarse_to_fine(len(level_pairs))]
+    state_order = np.array(coarse_to_fine(len(state_sweep)), dtype=int)
+
+    report = SequentialTestReport(
+        waves_run=0,
+        llm_calls=0,
+        full_sweep_llm_calls=len(level_pairs) * len(state_order) * calls_per_vignette,
+        stop_reason="full sweep",
+        alpha_per_wave=sequential_config.alpha_per_wave,
+    )
+    states_run = {level_pair: 0 for level_pair in level_order}
+    predictions = {}
+    summaries = {}
+    stat, p_value = math.nan, math.nan
+    for wave in range(1, num_waves + 1):
+        num_levels = max(
+            min(sequential_config.min_levels, len(level_order)),
+            math.ceil(len(level_order) * wave / num_waves),
+        )
+        num_states = math.ceil(len(state_order) * wave / num_waves)
+        # Levels already in the sweep need the next states, levels new to it all states so far.
+        pending_levels = defaultdict(list)
+        for level_pair in level_order[:num_levels]:
+            if states_run[level_pair] < num_states:
+                pending_levels[states_run[level_pair]].append(level_pair)
+        for first_state, pairs in pending_levels.items():
+            new_states = state_order[first_state:num_states]
+            experiment = make_experiment(pairs, state_sweep[new_states])
+            predictions_by_levels = experiment._create_and_predict(
+                **predict_kwargs
+            ).split_by_levels(pairs)
+            for level_pair, level_predictions in predictions_by_levels.items():
+                if level_pair in predictions:
+                    predictions[level_pair].examples += level_predictions.examples
+                    predictions[level_pair].next_actions += (
+                        level_predictions.next_actions
+                    )
+                    predictions[level_pair].completions += level_predictions.completions
+                else:
+                    predictions[level_pair] = level_predictions
+                summaries[level_pair] = experiment._summarize(
+                    predictions[level_pair], [level_pair[0]], [level_pair[1]]
+                )
+                states_run[level_pair] = num_states
+            report.llm_calls += len(pairs) * len(new_states) * calls_per_vignette
+
+        try:
+            stat, p_value = tgt_hypothesis.statistical_test(
+                {str(level_pair): summary for level_pair, summary in summaries.items()},
+                **stat_test_kwargs,
+            )
+        except (ZeroDivisionError, ValueError) as e:
+            # Early waves may not have predicted enough target actions for a statistic (e.g. no category at
+            # all for a chi-square test). Such a wave decides nothing, like a NaN p-value.
+            print(f"Wave {wave}/{num_waves}: no statistic yet ({e!r})")
+            stat, p_value = math.nan, math.nan
+        report.waves_run = wave
+        report.history.append((num_levels, num_states, stat, p_value))
+        print(f"Wave {wave}/{num_waves}: statistic={stat}, p-value={p_value}")
+
+        if wave == num_waves:
+            break
+        # A NaN p-value is neither significant nor futile; only the budget can stop the sweep then.
+        if p_value <= sequential_config.alpha_per_wave:
+            report.stop_reason = "significant"
+            break
+        if (
+            sequential_config.futility_p_value is not None
+            and wave >= sequential_config.min_waves
+            and p_value >= sequential_config.futility_p_value
+        ):
+            report.stop_reason = "futility"
+            break
+        if (
+            sequential_config.max_llm_calls is not None
+            and report.llm_calls >= sequential_config.max_llm_calls
+        ):
+            report.stop_reason = "budget"
+            break
+
+    print(report)
+    return stat, sequential_config.adjusted_p_value(p_value), report
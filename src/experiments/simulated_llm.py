@@ -0,0 +1,232 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import *
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.pydantic_v1 import Field, PrivateAttr
+
+from environment.action_spaces import ActionSpace, HOActionSpace
+
+
+class SimulatedLLMError(Exception):
+    pass
+
+
+class SimulatedRateLimitError(SimulatedLLMError):
+    pass
+
+
+_LEVEL_PATTERNS = {
+    "persistence_level": re.compile(r"Your persistence is (\d+)/10"),
+    "geometry_proficiency_level": re.compile(r"Your geometry proficiency is (\d+)/10"),
+    "num_submission_attempts": re.compile(r"NUM_SUBMISSION_ATTEMPTS[^:\n]*: (\d+)"),
+    "minutes_elapsed": re.compile(r"MINUTES_ELAPSED[^:\n]*: (\d+)"),
+}
+_MEASUREMENT_FLAG_PATTERN = re.compile(
+    r"^(AP|AF1|AF2|AX|F1P|F1F2|F1X|F2P|F2X|PX): (\d)", re.MULTILINE
+)
+_POINT_PATTERN = re.compile(r"F1|F2|A|P|X")
+# Operands of measurement labels: "MEASURE-X-F1" (action spaces B and C) and "CALC(f1, o)" (action space D)
+_OPERANDS_PATTERN = re.compile(r"^MEASURE-(\w+)-(\w+)$|^CALC\((\w+), *(\w+)\)$")
+# Point names as they appear in labels, by the name the measurement flags use. D calls X "o" (or "x").
+_LABEL_POINTS = {"a": "A", "p": "P", "f1": "F1", "f2": "F2", "x": "X", "o": "X"}
+
+_FILLER_WORDS = (
+    "the learner has already looked at the orbit and is considering which distance would help check "
+    "whether the sum of distances to both foci stays constant given how the session has gone so far"
+).split()
+
+
+def label_points(label: Text) -> FrozenSet[Text]:
+    """The points a measurement label measures between, named as in the measurement flags; empty for labels
+    that aren't measurements.
+
+    >>> sorted(label_points("MEASURE-X-F1")), sorted(label_points("CALC(f1, o)")), label_points("QUIT")
+    (['F1', 'X'], ['F1', 'X'], frozenset())
+    >>> label_points("MEASURE-X-F1") in parse_vignette("F1X: 1")["measured"]
+    True
+    """
+    match = _OPERANDS_PATTERN.match(label)
+    if match is None:
+        return frozenset()
+    return frozenset(
+        _LABEL_POINTS[operand.lower()]
+        for operand in match.groups()
+        if operand is not None and operand.lower() in _LABEL_POINTS
+    )
+
+
+def parse_vignette(prompt_text: Text) -> dict:
+    """Recover the learner levels and state variables from a rendered vignette prompt."""
+    vignette = {}
+    for key, pattern in _LEVEL_PATTERNS.items():
+        match = pattern.search(prompt_text)
+        vignette[key] = int(match.group(1)) if match else None
+    vignette["measured"] = {
+        frozenset(_POINT_PATTERN.findall(flag))
+        for flag, value in _MEASUREMENT_FLAG_PATTERN.findall(prompt_text)
+        if value == "1"
+    }
+    return vignette
+
+
+def default_action_distribution(
+    action_space: ActionSpace, vignette: dict
+) -> Dict[Text, float]:
+    """Plausible next-action weights for a vignette.
+
+    Less persistent learners quit more often as submissions and time pile up, more proficient learners prefer
+    productive measurements they haven't made yet, and submitting gets likelier as measurements accumulate."""
+    persistence = vignette.get("persistence_level") or 5
+    proficiency = vignette.get("geometry_proficiency_level") or 5
+    submissions = vignette.get("num_submission_attempts") or 0
+    minutes = vignette.get("minutes_elapsed") or 0
+    measured = vignette.get("measured", set())
+
+    productive_labels = (
+        set(action_space.productive_action_labels)
+        if isinstance(action_space, HOActionSpace)
+        else set()
+    )
+    exit_label = (
+        action_space.exit_action_label
+        if isinstance(action_space, HOActionSpace)
+        else None
+    )
+
+    weights = {}
+    for label in action_space.actions.keys():
+        if label == "UNPREDICTED":
+            weights[label] = 0.0
+        elif label == exit_label:
+            weights[label] = (0.1 + 0.15 * submissions + 0.02 * minutes) * (
+                (11 - persistence) / 10
+            )
+        elif label.startswith("SUBMIT"):
+            weights[label] = 0.1 + 0.2 * len(measured)
+        elif label in productive_labels:
+            already_measured = label_points(label) in measured
+            weights[label] = (0.2 if already_measured else 1.0) * (
+                1 + proficiency / 2
+            )
+        else:
+            weights[label] = 1 + (10 - proficiency) / 4
+    return weights
+
+
+class SimulatedChatModel(BaseChatModel):
+    """Offline stand-in for a chat model, for load-testing the prediction pipeline without API costs.
+
+    Each response is chain-of-thought-length filler text ending with an action label drawn from
+    `action_distribution(action_space, parse_vignette(prompt))`. Latency is log-normally distributed around
+    `latency_seconds`; requests fail with probability `error_rate` and once more than `requests_per_minute`
+    requests arrive within a minute."""
+
+    action_space: Any
+    action_distribution: Callable[[ActionSpace, dict], Dict[Text, float]] = (
+        default_action_distribution
+    )
+    latency_seconds: float = 0.0
+    latency_sigma: float = 0.5
+    error_rate: float = 0.0
+    requests_per_minute: Optional[int] = None
+    reasoning_words: int = 250
+    seed: Optional[int] = None
+    model_name: Text = "simulated"
+    temperature: float = 0.0
+    model_kwargs: dict = Field(default_factory=dict)
+
+    _rng: random.Random = PrivateAttr()
+    _request_times: deque = PrivateAttr(default_factory=deque)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "simulated-chat-model"
+
+    def _admit_request(self) -> float:
+        """Apply error and rate-limit injection; returns the latency to simulate."""
+        with self._lock:
+            now = time.monotonic()
+            if self.requests_per_minute is not None:
+                while self._request_times and now - self._request_times[0] > 60:
+                    self._request_times.popleft()
+                if len(self._request_times) >= self.requests_per_minute:
+                    raise SimulatedRateLimitError("Simulated rate limit exceeded.")
+                self._request_times.append(now)
+            if self._rng.random() < self.error_rate:
+                raise SimulatedLLMError("Simulated API error.")
+            if self.latency_seconds <= 0:
+                return 0.0
+            return self._rng.lognormvariate(0, self.latency_sigma) * self.latency_seconds
+
+    def _completion(self, prompt_text: Text) -> Text:
+        weights = self.action_distribution(self.action_space, parse_vignette(prompt_text))
+        labels = list(weights.keys())
+        with self._lock:
+            label = self._rng.choices(labels, weights=list(weights.values()))[0]
+            reasoning = " ".join(
+                self._rng.choice(_FILLER_WORDS) for _ in range(self.reasoning_words)
+            )
+            alternative = self._rng.choice(labels)
+        return f"{reasoning}\nI could also {alternative}, but on balance the next action is: {label}"
+
+    def _result(self, messages: List[BaseMessage], n: int) -> ChatResult:
+        prompt_text = "\n".join(str(message.content) for message in messages)
+        completions = [self._completion(prompt_text) for _ in range(n)]
+        prompt_tokens = len(prompt_text) // 4
+        completion_tokens = sum(len(completion) // 4 for completion in completions)
+        return ChatResult(
+            generations=[
+                ChatGeneration(message=AIMessage(content=completion))
+                for completion in completions
+            ],
+            llm_output={
+                "token_usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+                "model_name": self.model_name,
+            },
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        n: int = 1,
+        **kwargs: Any,
+    ) -> ChatResult:
+        latency = self._admit_request()
+        if latency > 0:
+            time.sleep(latency)
+        return self._result(messages, n)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        n: int = 1,
+        **kwargs: Any,
+    ) -> ChatResult:
+        latency = self._admit_request()
+        if latency > 0:
+            await asyncio.sleep(latency)
+        return self._result(messages, n)
@@ -1,19 +1,23 @@
-import copy
-import random
-
-random.seed(42)
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from enum import Enum
+from functools import cached_property
 from typing import *
 
 import randomname
 
+import seeding
 from environment.action_spaces import ActionSpace
 from environment.state_spaces import StateSweep
+from experiments.instrumentation import TRACER
 from experiments.mdhyp import Hypothesis, MonotonicUncalibrated
 
 import config
 
+if TYPE_CHECKING:
+    from langchain_core.language_models.chat_models import BaseChatModel
+
+    from experiments.sequential import SequentialTestConfig
+
 
 class ModelType(Enum):
     THEOR = "theor"
@@ -43,10 +47,13 @@ class ComputationalModel:
         )
 
 
-@dataclass
+@dataclass(frozen=True)
 class BehavioralModel:
     construct_name: str
-    hypotheses: list[Hypothesis]
+    hypotheses: Tuple[Hypothesis, ...]
+
+    def with_hypothesis(self, hypothesis: Hypothesis) -> "BehavioralModel":
+        return BehavioralModel(self.construct_name, (*self.hypotheses, hypothesis))
 
     def __str__(self):
         return "\n".join([str(h) for h in self.hypotheses])
@@ -61,7 +68,7 @@ class SingleHypothesisStack:
     hypothesis: Hypothesis
 
 
-@dataclass
+@dataclass(frozen=True)
 class LearnerCharacteristicModel:
     """Data class for modeling learner characteristics."""
 
@@ -77,6 +84,28 @@ class LearnerCharacteristicModel:
             == self.behavioral_model.construct_name
         ), "Construct names must match in all models."
 
+    @property
+    def deterministic_description(self) -> bool:
+        """Whether `describe` returns the same text on every call (some hypotheses randomize theirs)."""
+        return self.model_type not in [
+            ModelType.BEHAV,
+            ModelType.THEOR_COMP_BEHAV,
+        ] or all(
+            hypothesis.deterministic_description
+            for hypothesis in self.behavioral_model.hypotheses
+        )
+
+    @cached_property
+    def _rendered_description(self) -> str:
+        return self.describe()
+
+    @property
+    def description(self) -> str:
+        """`describe()`, rendered once per model unless one of its hypotheses randomizes its description."""
+        if not self.deterministic_description:
+            return self.describe()
+        return self._rendered_description
+
     def describe(self) -> str:
         """Formats the model descriptions based on its type."""
         if self.model_type == ModelType.BEHAV:
@@ -93,9 +122,12 @@ class LearnerCharacteristicModel:
         return f"{self.theoretical_model.construct_name}.{self.model_type.name}"
 
 
-@dataclass
+@dataclass(frozen=True)
 class Learner:
-    """Data class for a learner."""
+    """Data class for a learner.
+
+    Learners are immutable: `add_hypothesis` returns a new learner that shares the action space, the
+    theoretical and computational models and all existing hypotheses with this one."""
 
     action_space: ActionSpace
     persistence_model: Optional[LearnerCharacteristicModel] = None
@@ -143,7 +175,8 @@ class Learner:
             return self.persistence_model.behavioral_model
         raise ValueError(f"Unknown learner characteristic: {learner_characteristic}")
 
-    def add_hypothesis(self, new_hyp: SingleHypothesisStack):
+    def add_hypothesis(self, new_hyp: SingleHypothesisStack) -> "Learner":
+        """Return a new learner with `new_hyp` added to the behavioral model of its learner characteristic."""
         from learner.geometry_proficiency import (
             THEORETICAL_MODEL_DEFAULT as PROFICIENCY_THEORY,
         )
@@ -151,62 +184,83 @@ class Learner:
 
         self._check_for_hypothesis_conflicts(new_hyp)
 
-        """Add a new hypothesis to the learner model."""
         if (
             new_hyp.hypothesis.learner_characteristic
             == PROFICIENCY_THEORY.construct_name
         ):
-            if self.geometry_proficiency_model is not None:
-                # If there's already an existing model, just append the hypothesis to it.
-                self.geometry_proficiency_model.behavioral_model.hypotheses.append(
-                    new_hyp.hypothesis
-                )
-            else:
-                # Otherwise, create a new model out of the SingleHypothesisStack.
-                self.geometry_proficiency_model = LearnerCharacteristicModel(
-                    ModelType.THEOR_COMP_BEHAV,
-                    new_hyp.theoretical_model,
-                    new_hyp.computational_model,
-                    BehavioralModel(
-                        new_hyp.hypothesis.learner_characteristic, [new_hyp.hypothesis]
-                    ),
-                )
+            field_name = "geometry_proficiency_model"
         elif (
             new_hyp.hypothesis.learner_characteristic
             == PERSISTENCE_THEORY.construct_name
         ):
-            if self.persistence_model is not None:
-                # If there's already an existing model, just append the hypothesis to it.
-                self.persistence_model.behavioral_model.hypotheses.append(
-                    new_hyp.hypothesis
-                )
-            else:
-                # Otherwise, create a new model out of the SingleHypothesisStack.
-                self.persistence_model = LearnerCharacteristicModel(
-                    ModelType.THEOR_COMP_BEHAV,
-                    new_hyp.theoretical_model,
-                    new_hyp.computational_model,
-                    BehavioralModel(
-                        new_hyp.hypothesis.learner_characteristic, [new_hyp.hypothesis]
-                    ),
-                )
+            field_name = "persistence_model"
+        else:
+            raise ValueError(
+                f"Unknown learner characteristic: {new_hyp.hypothesis.learner_characteristic}"
+            )
 
-        return copy.deepcopy(self)
+        existing_model = getattr(self, field_name)
+        if existing_model is not None:
+            # If there's already an existing model, extend its behavioral model with the hypothesis.
+            new_model = replace(
+                existing_model,
+                behavioral_model=existing_model.behavioral_model.with_hypothesis(
+                    new_hyp.hypothesis
+                ),
+            )
+        else:
+            # Otherwise, create a new model out of the SingleHypothesisStack.
+            new_model = LearnerCharacteristicModel(
+                ModelType.THEOR_COMP_BEHAV,
+                new_hyp.theoretical_model,
+                new_hyp.computational_model,
+                BehavioralModel(
+                    new_hyp.hypothesis.learner_characteristic, (new_hyp.hypothesis,)
+                ),
+            )
+        return replace(self, **{field_name: new_model})
 
+    @TRACER.traced("test_hypothesis", session=True)
     def test_hypothesis(
         self,
         tgt_hyp_stack: SingleHypothesisStack,
         dataset_name: Text,
         state_sweep_override: Optional[StateSweep] = None,
         tgt_lc_value_range_override: Tuple[int, int] = None,
-        fake_llm: bool = False,
+        fake_llm: Union[bool, "BaseChatModel"] = False,
         prompt_name: str = "vokiw11262/sl-calibration-cot",
         llm_name: Text = "gpt-4-turbo",
         llm_temperature: float = 0,
+        max_concurrency: Optional[int] = None,
+        upload_metrics: bool = False,
+        fused: bool = False,
+        num_generations_per_sample: int = 1,
+        n_completions_per_request: bool = False,
+        prompt_layout: Text = "hub",
+        sequential: Optional["SequentialTestConfig"] = None,
+        resume: bool = True,
+        seed: Optional[int] = None,
+        fused_levels_per_batch: Optional[int] = None,
         **stat_test_kwargs,
     ):
-        """Test whether the target hypothesis is satisfied."""
+        """Test whether the target hypothesis is satisfied.
+
+        With `fused=True`, the levels of the target learner characteristic are run as fused experiments of
+        `fused_levels_per_batch` levels (default: `config.FUSED_LEVELS_PER_BATCH`; metrics are then computed
+        locally only). With a `sequential` config, levels and states are added in waves until the test is
+        decided; the p-value is then Bonferroni-adjusted for the waves, and a `SequentialTestReport` is returned
+        after the statistic and p-value.
+
+        Unless `resume=False`, the result and raw completions of every level are checkpointed as soon as the
+        level finishes, and levels already checkpointed for the same hypothesis, learner model, state sweep and
+        prediction settings are not run again. Sequential tests are not checkpointed.
+
+        The levels of the non-target learner characteristic are drawn from a stream per hypothesis and target
+        level, derived from `seed` (default: `seeding.ROOT_SEED`), so they don't depend on what ran before."""
+        from experiments.checkpoint import fingerprint
         from experiments.experiment import Experiment
+        from experiments.resources import RESOURCE_POOL
+        from experiments.sequential import run_sequential_test
 
         from .geometry_proficiency import THEORETICAL_MODEL_DEFAULT as GP_THEORY
         from .persistence import THEORETICAL_MODEL_DEFAULT as P_THEORY
@@ -215,9 +269,11 @@ class Learner:
         tgt_behavioral_model = self._find_behavioral_model(
             tgt_hypothesis.learner_characteristic
         )
+        # Compared by equality: callers may pass a stack that is equal to, but not the same object as, the one
+        # the learner was built with.
         assert (
             tgt_hypothesis in tgt_behavioral_model.hypotheses
-        ), f"{tgt_hypothesis} not found in learner model!"
+        ), f"{tgt_hypothesis.behavior_name} not found in learner model!"
 
         state_sweep = (
             tgt_hypothesis.state_sweep
@@ -230,30 +286,145 @@ class Learner:
             else tgt_lc_value_range_override
         )
 
-        experiment_outputs = dict()
         # Sweep over different values of the learner characteristic of the target hypothesis.
+        level_pairs = []
         for lc_level in range(*tgt_lc_value_range):
             # For the LCs that are not currently being tested, just pick a random value between 1 and 10 (since non-target LCs shouldn't make a difference to the marginal distributional hypothesis).
+            non_tgt_level = int(
+                seeding.generator(
+                    "non_target_level",
+                    tgt_hypothesis.behavior_name,
+                    tgt_hypothesis.learner_characteristic,
+                    lc_level,
+                    root_seed=seed,
+                ).integers(1, 11)
+            )
             if tgt_hypothesis.learner_characteristic == GP_THEORY.construct_name:
-                gp_level, persistence_level = lc_level, random.randint(1, 10)
+                gp_level, persistence_level = lc_level, non_tgt_level
             elif tgt_hypothesis.learner_characteristic == P_THEORY.construct_name:
-                persistence_level, gp_level = lc_level, random.randint(1, 10)
-            experiment = Experiment(
+                persistence_level, gp_level = lc_level, non_tgt_level
+            level_pairs.append((persistence_level, gp_level))
+
+        def make_experiment(pairs, sweep=state_sweep):
+            return Experiment(
                 experiment_id=randomname.get_name(),
                 dataset_name=dataset_name,
                 prompt_name=prompt_name,
                 geometry_proficiency_model=self.geometry_proficiency_model,
                 persistence_model=self.persistence_model,
-                geometry_proficiency_levels=[gp_level],
-                persistence_levels=[persistence_level],
-                state_sweep=state_sweep,
+                geometry_proficiency_levels=[gp_level for _, gp_level in pairs],
+                persistence_levels=[persistence_level for persistence_level, _ in pairs],
+                state_sweep=sweep,
                 action_space=self.action_space,
                 model_name=llm_name,
                 temperature=llm_temperature,
+                learner_levels=pairs,
+                prompt_layout=prompt_layout,
             )
-            experiment_outputs[experiment.experiment_id] = experiment.run(
-                fake_llm=fake_llm
+
+        if sequential is not None:
+            return run_sequential_test(
+                tgt_hypothesis,
+                level_pairs,
+                state_sweep,
+                make_experiment,
+                sequential,
+                calls_per_vignette=(
+                    1 if n_completions_per_request else num_generations_per_sample
+                ),
+                predict_kwargs=dict(
+                    num_generations_per_sample=num_generations_per_sample,
+                    fake_llm=fake_llm,
+                    max_concurrency=max_concurrency,
+                    n_completions_per_request=n_completions_per_request,
+                ),
+                stat_test_kwargs=stat_test_kwargs,
+            )
+
+        def tgt_level(level_pair):
+            persistence_level, gp_level = level_pair
+            if tgt_hypothesis.learner_characteristic == GP_THEORY.construct_name:
+                return gp_level
+            return persistence_level
+
+        checkpoints = RESOURCE_POOL.checkpoint_store() if resume else None
+        run_key = fingerprint(
+            tgt_hypothesis,
+            self.persistence_model,
+            self.geometry_proficiency_model,
+            self.action_space,
+            state_sweep.fingerprint,
+            prompt_name,
+            prompt_layout,
+            llm_name,
+            llm_temperature,
+            num_generations_per_sample,
+            n_completions_per_request,
+            seeding.ROOT_SEED if seed is None else seed,
+            # Fake and simulated LLM runs must not be mistaken for real ones.
+            fake_llm if isinstance(fake_llm, bool) else type(fake_llm).__name__,
+        )
+        checkpointed = checkpoints.get_results(run_key) if checkpoints else {}
+        if checkpointed:
+            print(
+                f"Resuming: {len(checkpointed)} level(s) of {tgt_hypothesis.behavior_name} already checkpointed."
             )
+
+        def checkpoint_completions(pairs, predictions):
+            if checkpoints is not None:
+                checkpoints.put_completions(run_key, tgt_level(pairs[0]), predictions)
+
+        def checkpoint_result(level_pair, result):
+            if checkpoints is not None:
+                checkpoints.put_result(run_key, tgt_level(level_pair), result)
+
+        experiment_outputs = {
+            f"{result['experiment_id']}-{lc_level}": result
+            for lc_level, result in checkpointed.items()
+            if lc_level in range(*tgt_lc_value_range)
+        }
+        pending_level_pairs = [
+            level_pair
+            for level_pair in level_pairs
+            if tgt_level(level_pair) not in checkpointed
+        ]
+        if fused:
+            # One dataset upload and one prediction pass per batch of levels, split back into per-level results
+            # and checkpointed before the next batch starts.
+            batch_size = fused_levels_per_batch or config.FUSED_LEVELS_PER_BATCH
+            for start in range(0, len(pending_level_pairs), batch_size):
+                fused_outputs = make_experiment(
+                    pending_level_pairs[start : start + batch_size]
+                ).run_per_level(
+                    num_generations_per_sample=num_generations_per_sample,
+                    fake_llm=fake_llm,
+                    max_concurrency=max_concurrency,
+                    n_completions_per_request=n_completions_per_request,
+                    on_predictions=lambda level_pair, predictions: (
+                        checkpoint_completions([level_pair], predictions)
+                    ),
+                )
+                for result_id, result in fused_outputs.items():
+                    checkpoint_result(
+                        (
+                            result["persistence_levels"][0],
+                            result["geometry_proficiency_levels"][0],
+                        ),
+                        result,
+                    )
+                    experiment_outputs[result_id] = result
+        else:
+            for level_pair in pending_level_pairs:
+                experiment = make_experiment([level_pair])
+                experiment_outputs[experiment.experiment_id] = experiment.run(
+                    num_generations_per_sample=num_generations_per_sample,
+                    fake_llm=fake_llm,
+                    max_concurrency=max_concurrency,
+                    upload_metrics=upload_metrics,
+                    n_completions_per_request=n_completions_per_request,
+                    on_predictions=checkpoint_completions,
+                )
+                checkpoint_result(level_pair, experiment_outputs[experiment.experiment_id])
         stat, p_value = tgt_hypothesis.statistical_test(
             experiment_outputs, **stat_test_kwargs
         )
@@ -0,0 +1,65 @@
+import threading
+from typing import *
+
+from environment.action_spaces import ActionSpace
+
+from .learners import Learner, SingleHypothesisStack
+
+LearnerTest = Tuple[Learner, Optional[SingleHypothesisStack]]
+
+
+class LearnerTestRegistry:
+    """Named (learner, target hypothesis stack) pairs, built lazily and memoised per action space.
+
+    A test is registered as a factory `factory(action_space, stack) -> (learner, target hypothesis stack)`.
+    `stack(hypothesis_factory, hyp_class)` returns the first stack of `hypothesis_factory(hyp_class,
+    action_space)`, building it only once per action space, so tests that share a hypothesis share the object.
+    Nothing is built until a test is looked up with `get`."""
+
+    def __init__(self):
+        self._factories: Dict[Text, Callable[..., LearnerTest]] = {}
+        self._tests: Dict[Tuple[Text, Text], LearnerTest] = {}
+        self._stacks: Dict[Tuple[Callable, type, Text], SingleHypothesisStack] = {}
+        self._lock = threading.RLock()
+
+    def register(self, name: Text):
+        def decorator(factory: Callable[..., LearnerTest]):
+            assert name not in self._factories, f"Test {name} is already registered."
+            self._factories[name] = factory
+            return factory
+
+        return decorator
+
+    def names(self) -> List[Text]:
+        return list(self._factories.keys())
+
+    def __contains__(self, name: Text) -> bool:
+        return name in self._factories
+
+    def stack(
+        self,
+        hypothesis_factory: Callable[[type, ActionSpace], List[SingleHypothesisStack]],
+        hyp_class: type,
+        action_space: ActionSpace,
+    ) -> SingleHypothesisStack:
+        key = (hypothesis_factory, hyp_class, repr(action_space))
+        with self._lock:
+            if key not in self._stacks:
+                self._stacks[key] = hypothesis_factory(hyp_class, action_space)[0]
+            return self._stacks[key]
+
+    def get(self, name: Text, action_space: ActionSpace) -> LearnerTest:
+        if name not in self._factories:
+            raise KeyError(
+                f"Unknown test {name}; registered tests are {', '.join(self._factories)}."
+            )
+        key = (name, repr(action_space))
+        with self._lock:
+            if key not in self._tests:
+                self._tests[key] = self._factories[name](
+                    action_space,
+                    lambda hypothesis_factory, hyp_class: self.stack(
+                        hypothesis_factory, hyp_class, action_space
+                    ),
+                )
+            return self._tests[key]
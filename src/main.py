@@ -1,166 +1,169 @@
-import random
 from typing import *
 
-import numpy as np
+import config
+import seeding
+from experiments.mdhyp import (
+    MonotonicCalibratedB,
+    MonotonicCalibratedE,
+    MonotonicCalibratedI,
+    MonotonicUncalibrated,
+    UniformCalibratedF,
+    UniformCalibratedH,
+    UniformDistributionUncalibrated,
+)
+from learner.geometry_proficiency import (
+    proficiency_measure_monotonic,
+    proficiency_measure_uniform,
+)
+from learner.learners import Learner
+from learner.persistence import persist_abandon_num_submissions, persist_abandon_time
+from learner.registry import LearnerTestRegistry
 
-RANDOM_SEED = 42
+# Learner models and the hypothesis to test on each, by test name. Entries are only built when looked up.
+LEARNER_MODELS_TESTS = LearnerTestRegistry()
 
-np.random.seed(RANDOM_SEED)
-random.seed(RANDOM_SEED)
 
-import config
+@LEARNER_MODELS_TESTS.register("A")
+def _(action_space, stack):
+    tgt = stack(proficiency_measure_monotonic, MonotonicUncalibrated)
+    return Learner(action_space).add_hypothesis(tgt), tgt
+
+
+@LEARNER_MODELS_TESTS.register("B")
+def _(action_space, stack):
+    tgt = stack(proficiency_measure_monotonic, MonotonicCalibratedB)
+    return Learner(action_space).add_hypothesis(tgt), tgt
+
 
+@LEARNER_MODELS_TESTS.register("C")
+def _(action_space, stack):
+    tgt = stack(persist_abandon_time, MonotonicCalibratedB)
+    return Learner(action_space).add_hypothesis(tgt), tgt
 
-def main(dataset_name, action_space, tgt_hyp):
-    from experiments.mdhyp import (
-        MonotonicCalibratedB,
-        MonotonicCalibratedE,
-        MonotonicCalibratedI,
-        MonotonicUncalibrated,
-        UniformCalibratedF,
-        UniformCalibratedH,
-        UniformDistributionUncalibrated,
+
+@LEARNER_MODELS_TESTS.register("C_test_1")
+def _(action_space, stack):
+    tgt = stack(persist_abandon_time, MonotonicUncalibrated)
+    return Learner(action_space).add_hypothesis(tgt), tgt
+
+
+@LEARNER_MODELS_TESTS.register("D")
+def _(action_space, stack):
+    tgt = stack(proficiency_measure_uniform, UniformDistributionUncalibrated)
+    learner = (
+        Learner(action_space)
+        .add_hypothesis(stack(proficiency_measure_monotonic, MonotonicCalibratedB))
+        .add_hypothesis(tgt)
     )
-    from learner.geometry_proficiency import (
-        proficiency_measure_monotonic,
-        proficiency_measure_uniform,
+    return learner, tgt
+
+
+@LEARNER_MODELS_TESTS.register("E")
+def _(action_space, stack):
+    tgt = stack(persist_abandon_time, MonotonicCalibratedE)
+    return Learner(action_space).add_hypothesis(tgt), tgt
+
+
+@LEARNER_MODELS_TESTS.register("F_pre")
+def _(action_space, stack):
+    tgt = stack(proficiency_measure_uniform, UniformCalibratedF)
+    learner = (
+        Learner(action_space)
+        .add_hypothesis(stack(proficiency_measure_monotonic, MonotonicCalibratedB))
+        .add_hypothesis(tgt)
     )
-    from learner.learners import Learner
-    from learner.persistence import (
-        persist_abandon_num_submissions,
-        persist_abandon_time,
+    return learner, tgt
+
+
+@LEARNER_MODELS_TESTS.register("F")
+def _(action_space, stack):
+    tgt = stack(proficiency_measure_monotonic, MonotonicCalibratedB)
+    learner = (
+        Learner(action_space)
+        .add_hypothesis(tgt)
+        .add_hypothesis(stack(proficiency_measure_uniform, UniformCalibratedF))
     )
+    return learner, tgt
 
-    LEARNER_MODELS_TESTS = {
-        "A": (
-            Learner(action_space).add_hypothesis(
-                proficiency_measure_monotonic(MonotonicUncalibrated, action_space)[0]
-            ),
-            proficiency_measure_monotonic(MonotonicUncalibrated, action_space)[0],
-        ),
-        "B": (
-            Learner(action_space).add_hypothesis(
-                proficiency_measure_monotonic(MonotonicCalibratedB, action_space)[0]
-            ),
-            proficiency_measure_monotonic(MonotonicCalibratedB, action_space)[0],
-        ),
-        "C": (
-            Learner(action_space).add_hypothesis(
-                persist_abandon_time(MonotonicCalibratedB, action_space)[0]
-            ),
-            persist_abandon_time(MonotonicCalibratedB, action_space)[0],
-        ),
-        "C_test_1": (
-            Learner(action_space).add_hypothesis(
-                persist_abandon_time(MonotonicUncalibrated, action_space)[0]
-            ),
-            persist_abandon_time(MonotonicUncalibrated, action_space)[0],
-        ),
-        "C2": (),
-        "D": (
-            Learner(action_space)
-            .add_hypothesis(
-                proficiency_measure_monotonic(MonotonicCalibratedB, action_space)[0]
-            )
-            .add_hypothesis(
-                proficiency_measure_uniform(
-                    UniformDistributionUncalibrated, action_space
-                )[0]
-            ),
-            proficiency_measure_uniform(UniformDistributionUncalibrated, action_space)[
-                0
-            ],
-        ),
-        "E": (
-            Learner(action_space).add_hypothesis(
-                persist_abandon_time(MonotonicCalibratedE, action_space)[0]
-            ),
-            persist_abandon_time(MonotonicCalibratedE, action_space)[0],
-        ),
-        "E2": (),
-        "F_pre": (
-            Learner(action_space)
-            .add_hypothesis(
-                proficiency_measure_monotonic(MonotonicCalibratedB, action_space)[0]
-            )
-            .add_hypothesis(
-                proficiency_measure_uniform(UniformCalibratedF, action_space)[0]
-            ),
-            proficiency_measure_uniform(UniformCalibratedF, action_space)[0],
-        ),
-        "F": (
-            Learner(action_space)
-            .add_hypothesis(
-                proficiency_measure_monotonic(MonotonicCalibratedB, action_space)[0]
-            )
-            .add_hypothesis(
-                proficiency_measure_uniform(UniformCalibratedF, action_space)[0]
-            ),
-            proficiency_measure_monotonic(MonotonicCalibratedB, action_space)[0],
-        ),
-        "G": (
-            Learner(action_space).add_hypothesis(
-                proficiency_measure_uniform(UniformCalibratedF, action_space)[0]
-            ),
-            proficiency_measure_uniform(UniformCalibratedF, action_space)[0],
-        ),
-        "H": (
-            Learner(action_space).add_hypothesis(
-                proficiency_measure_uniform(UniformCalibratedH, action_space)[0]
-            ),
-            None,
-        ),
-        "I": (
-            Learner(action_space).add_hypothesis(
-                persist_abandon_num_submissions(MonotonicCalibratedI, action_space)[0]
-            ),
-            None,
-        ),
-        "J1": (
-            Learner(action_space)
-            .add_hypothesis(
-                persist_abandon_num_submissions(MonotonicCalibratedI, action_space)[0]
-            )
-            .add_hypothesis(
-                proficiency_measure_uniform(UniformCalibratedH, action_space)[0]
-            ),
-            persist_abandon_num_submissions(MonotonicCalibratedI, action_space)[0],
-        ),
-        "J2": (
-            Learner(action_space)
-            .add_hypothesis(
-                persist_abandon_num_submissions(MonotonicCalibratedI, action_space)[0]
-            )
-            .add_hypothesis(
-                proficiency_measure_uniform(UniformCalibratedH, action_space)[0]
-            ),
-            proficiency_measure_uniform(UniformCalibratedH, action_space)[0],
-        ),
-    }
-
-    result = LEARNER_MODELS_TESTS[tgt_hyp][0].test_hypothesis(
-        tgt_hyp_stack=LEARNER_MODELS_TESTS[tgt_hyp][1], dataset_name=dataset_name
+
+@LEARNER_MODELS_TESTS.register("G")
+def _(action_space, stack):
+    tgt = stack(proficiency_measure_uniform, UniformCalibratedF)
+    return Learner(action_space).add_hypothesis(tgt), tgt
+
+
+@LEARNER_MODELS_TESTS.register("H")
+def _(action_space, stack):
+    learner = Learner(action_space).add_hypothesis(
+        stack(proficiency_measure_uniform, UniformCalibratedH)
+    )
+    return learner, None
+
+
+@LEARNER_MODELS_TESTS.register("I")
+def _(action_space, stack):
+    learner = Learner(action_space).add_hypothesis(
+        stack(persist_abandon_num_submissions, MonotonicCalibratedI)
+    )
+    return learner, None
+
+
+@LEARNER_MODELS_TESTS.register("J1")
+def _(action_space, stack):
+    tgt = stack(persist_abandon_num_submissions, MonotonicCalibratedI)
+    learner = (
+        Learner(action_space)
+        .add_hypothesis(tgt)
+        .add_hypothesis(stack(proficiency_measure_uniform, UniformCalibratedH))
+    )
+    return learner, tgt
+
+
+@LEARNER_MODELS_TESTS.register("J2")
+def _(action_space, stack):
+    tgt = stack(proficiency_measure_uniform, UniformCalibratedH)
+    learner = (
+        Learner(action_space)
+        .add_hypothesis(stack(persist_abandon_num_submissions, MonotonicCalibratedI))
+        .add_hypothesis(tgt)
+    )
+    return learner, tgt
+
+
+def main(dataset_name, action_space, tgt_hyp, **test_kwargs):
+    learner, tgt_hyp_stack = LEARNER_MODELS_TESTS.get(tgt_hyp, action_space)
+    result = learner.test_hypothesis(
+        tgt_hyp_stack=tgt_hyp_stack,
+        dataset_name=dataset_name,
+        **test_kwargs,
     )
     return result
 
 
 if __name__ == "__main__":
-    from environment.action_spaces import HOActionSpaceB, HOActionSpaceC, HOActionSpaceD
-
-    ACTION_SPACES = {
-        "B": HOActionSpaceB(),
-        "C": HOActionSpaceC(),
-        "D": HOActionSpaceD(),
-    }
-
-    SUFFIX = "-v2"
-
-    for action_space_label, action_space in ACTION_SPACES.items():
-        TGT_HYP = "E"
-        config.ACTION_SPACE = action_space
-        config.DATASET_NAME = f"node-{TGT_HYP}-actionspace-{action_space_label}{SUFFIX}"
-        result = main(
-            dataset_name=config.DATASET_NAME, action_space=action_space, tgt_hyp=TGT_HYP
-        )
-        print(f"Result for Hyp {TGT_HYP} HOActionSpace{action_space_label}: {result}")
-        breakpoint()
+    import argparse
+
+    import sweep
+
+    parser = argparse.ArgumentParser(
+        description="Test hypotheses over a matrix of action spaces and models in parallel."
+    )
+    parser.add_argument("--tests", nargs="+", default=["E"])
+    parser.add_argument("--action-spaces", nargs="+", default=["B", "C", "D"])
+    parser.add_argument("--models", nargs="+", default=["gpt-4-turbo"])
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--suffix", default="-v2")
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=seeding.ROOT_SEED,
+        help="Root seed of the random streams (state sweeps, non-target learner levels) of every cell.",
+    )
+    args = parser.parse_args()
+
+    cells = sweep.build_cells(
+        args.tests, args.action_spaces, args.models, suffix=args.suffix, seed=args.seed
+    )
+    results = sweep.run_sweep(cells, max_workers=args.max_workers)
+    print(sweep.results_table(results))
+    print(f"Results written to {sweep.save_results(results)}")
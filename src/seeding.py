@@ -0,0 +1,65 @@
+"""Named, independent random streams derived from one root seed.
+
+Every consumer of randomness asks for its own stream by name, e.g. `generator("non_target_level", "E", "3")`.
+A stream depends only on the root seed and its names (via `np.random.SeedSequence` spawn keys), never on
+which other streams were used before it or in which process, so parallel and serial runs draw identical
+numbers. Set `HYPMIX_SEED` to change the root seed of a run.
+"""
+
+import hashlib
+import os
+import random
+import threading
+from typing import *
+
+import numpy as np
+
+ROOT_SEED = int(os.environ.get("HYPMIX_SEED", "42"))
+
+_spawners: Dict[Tuple[Any, ...], np.random.SeedSequence] = {}
+_spawners_lock = threading.Lock()
+
+
+def _name_key(name: Text) -> int:
+    return int.from_bytes(hashlib.sha256(name.encode("utf-8")).digest()[:4], "little")
+
+
+def seed_sequence(*names: Any, root_seed: Optional[int] = None) -> np.random.SeedSequence:
+    """The seed sequence of the stream identified by `names` (converted with `str`)."""
+    return np.random.SeedSequence(
+        ROOT_SEED if root_seed is None else root_seed,
+        spawn_key=tuple(_name_key(str(name)) for name in names),
+    )
+
+
+def generator(*names: Any, root_seed: Optional[int] = None) -> np.random.Generator:
+    return np.random.default_rng(seed_sequence(*names, root_seed=root_seed))
+
+
+def next_generator(*names: Any) -> np.random.Generator:
+    """The next of a series of independent generators spawned from stream `names`.
+
+    Unlike `generator`, repeated calls return different numbers; the n-th call in a process always gets the
+    n-th child of the stream."""
+    key = (ROOT_SEED, *map(str, names))
+    with _spawners_lock:
+        if key not in _spawners:
+            _spawners[key] = seed_sequence(*names)
+        (child,) = _spawners[key].spawn(1)
+    return np.random.default_rng(child)
+
+
+def reset():
+    """Restart every `next_generator` series from its first child."""
+    with _spawners_lock:
+        _spawners.clear()
+
+
+def py_random(*names: Any, root_seed: Optional[int] = None) -> random.Random:
+    """A `random.Random` for code that works with the standard library's random API."""
+    return random.Random(
+        int.from_bytes(
+            seed_sequence(*names, root_seed=root_seed).generate_state(4).tobytes(),
+            "little",
+        )
+    )
@@ -0,0 +1,176 @@
+"""Run a matrix of hypothesis tests (test key x action space x model) in parallel worker processes.
+
+Run from the repository root:
+
+    python src/main.py --tests E --action-spaces B C D --models gpt-4-turbo --max-workers 3
+
+Every cell runs in its own process with its own copy of the configuration, so cells never see each other's
+action space or dataset. A cell that fails is reported in the results table instead of stopping the sweep.
+Cells do share the completion cache and checkpoint store on disk; their SQLite connections wait for each
+other's writes (see `experiments.checkpoint.connect`).
+"""
+
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import *
+
+SWEEP_DIR = "results/sweeps"
+
+
+@dataclass
+class SweepCell:
+    """One hypothesis test of the sweep."""
+
+    test: Text
+    action_space: Text
+    model: Text
+    dataset_name: Text
+    test_kwargs: dict = field(default_factory=dict)
+
+
+@dataclass
+class CellResult:
+    cell: SweepCell
+    statistic: Optional[float] = None
+    p_value: Optional[float] = None
+    wall_seconds: float = 0.0
+    error: Optional[Text] = None
+
+
+def action_space_for(label: Text):
+    """`HOActionSpace<label>()`, e.g. `action_space_for("C")`."""
+    from environment import action_spaces
+
+    return getattr(action_spaces, f"HOActionSpace{label}")()
+
+
+def build_cells(
+    tests: Iterable[Text],
+    action_spaces: Iterable[Text],
+    models: Iterable[Text],
+    dataset_name_format: Text = "node-{test}-actionspace-{action_space}-{model}{suffix}",
+    suffix: Text = "",
+    **test_kwargs,
+) -> List[SweepCell]:
+    return [
+        SweepCell(
+            test=test,
+            action_space=action_space,
+            model=model,
+            dataset_name=dataset_name_format.format(
+                test=test, action_space=action_space, model=model, suffix=suffix
+            ),
+            test_kwargs=dict(test_kwargs),
+        )
+        for test, action_space, model in itertools.product(tests, action_spaces, models)
+    ]
+
+
+def _run_cell(cell: SweepCell, rate_limit_share: float) -> CellResult:
+    """Worker entry point. Runs in a fresh process, so changes to `config` stay local to the cell."""
+    import config
+    import seeding
+    from main import main
+
+    # Should a worker run several cells, randomized descriptions and unseeded state generators must still
+    # start from the beginning of their streams in every cell.
+    seeding.reset()
+
+    # The cell's seed also decides its state sweeps.
+    if cell.test_kwargs.get("seed") is not None:
+        config.STATE_SWEEPS.root_seed = cell.test_kwargs["seed"]
+
+    # Processes don't share rate-limit buckets; split each model's budget between the cells using it at once.
+    if cell.model in config.MODEL_RATE_LIMITS:
+        config.MODEL_RATE_LIMITS[cell.model] = {
+            kind: None if limit is None else max(1, int(limit * rate_limit_share))
+            for kind, limit in config.MODEL_RATE_LIMITS[cell.model].items()
+        }
+
+    start = time.perf_counter()
+    try:
+        result = main(
+            dataset_name=cell.dataset_name,
+            action_space=action_space_for(cell.action_space),
+            tgt_hyp=cell.test,
+            llm_name=cell.model,
+            **cell.test_kwargs,
+        )
+        statistic, p_value = result[0], result[1]
+        return CellResult(
+            cell,
+            statistic=float(statistic),
+            p_value=float(p_value),
+            wall_seconds=time.perf_counter() - start,
+        )
+    except Exception:
+        return CellResult(
+            cell, wall_seconds=time.perf_counter() - start, error=traceback.format_exc()
+        )
+
+
+def run_sweep(cells: List[SweepCell], max_workers: int) -> List[CellResult]:
+    """Run every cell, at most `max_workers` at a time, and return the results in the order of `cells`."""
+    max_workers = max(1, min(max_workers, len(cells)))
+    cells_per_model = {
+        model: sum(cell.model == model for cell in cells)
+        for model in {cell.model for cell in cells}
+    }
+    results = {}
+    # "spawn" so that no worker inherits state (config, clients, open caches) from the parent process, and one
+    # cell per worker process so that no cell inherits state from an earlier cell (Python 3.11+).
+    pool_kwargs = {"max_tasks_per_child": 1} if sys.version_info >= (3, 11) else {}
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        **pool_kwargs,
+    ) as executor:
+        futures = {
+            executor.submit(
+                _run_cell,
+                cell,
+                1 / min(max_workers, cells_per_model[cell.model]),
+            ): i
+            for i, cell in enumerate(cells)
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            status = "failed" if result.error else f"p-value={result.p_value}"
+            print(
+                f"[{len(results)}/{len(cells)}] {result.cell.test} / HOActionSpace{result.cell.action_space} / "
+                f"{result.cell.model}: {status} ({result.wall_seconds:.0f} s)"
+            )
+    return [results[i] for i in range(len(cells))]
+
+
+def results_table(results: List[CellResult]) -> Text:
+    header = f"{'test':<10} {'action space':<14} {'model':<20} {'statistic':>10} {'p-value':>10} {'wall s':>9}  error"
+    lines = [header, "-" * len(header)]
+    for result in results:
+        statistic = "" if result.statistic is None else f"{result.statistic:.4f}"
+        p_value = "" if result.p_value is None else f"{result.p_value:.4g}"
+        error = result.error.strip().splitlines()[-1] if result.error else ""
+        lines.append(
+            f"{result.cell.test:<10} {result.cell.action_space:<14} {result.cell.model:<20} "
+            f"{statistic:>10} {p_value:>10} {result.wall_seconds:>9.1f}  {error}"
+        )
+    return "\n".join(lines)
+
+
+def save_results(results: List[CellResult], sweep_dir: Text = SWEEP_DIR) -> Text:
+    os.makedirs(sweep_dir, exist_ok=True)
+    path = os.path.join(
+        sweep_dir, f"{datetime.now().isoformat(timespec='seconds').replace(':', '-')}.json"
+    )
+    with open(path, "w") as f:
+        json.dump([asdict(result) for result in results], f, indent=2)
+    return path